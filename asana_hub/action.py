@@ -2,6 +2,8 @@
 Defines an Action.
 """
 
+import json
+
 def get_subclasses(c):
     """Gets the subclasses of a class."""
     subclasses = c.__subclasses__()
@@ -15,6 +17,15 @@ class Action(object):
     # name of action
     name = "unnamed"
 
+    # packets of interactive actions take the transport's interactive lane
+    interactive = False
+
+    # dry runs don't replay packets left over from interrupted runs
+    dry_run = False
+
+    # actions that only use local data don't authenticate
+    requires_auth = True
+
     def __init__(self, args, app):
         self.args = args
         self.app = app
@@ -61,6 +72,99 @@ class Action(object):
             help="[setting] only sync issues [FIRST_ISSUE] and above"
             )
 
+        parser.add_argument(
+            '--asana-concurrency',
+            type=int,
+            action='store',
+            nargs='?',
+            const='',
+            dest='asana_concurrency',
+            help="[setting] max concurrent asana requests (default: 8)"
+            )
+
+        parser.add_argument(
+            '--github-concurrency',
+            type=int,
+            action='store',
+            nargs='?',
+            const='',
+            dest='github_concurrency',
+            help="[setting] max concurrent github requests (default: 4)"
+            )
+
+        parser.add_argument(
+            '--min-workers',
+            type=int,
+            action='store',
+            nargs='?',
+            const='',
+            dest='min_workers',
+            help="[setting] workers kept running while idle (default: 0)"
+            )
+
+        parser.add_argument(
+            '--max-workers',
+            type=int,
+            action='store',
+            nargs='?',
+            const='',
+            dest='max_workers',
+            help="[setting] max transport workers (default: cpu count)"
+            )
+
+        parser.add_argument(
+            '--worker-threads',
+            type=int,
+            action='store',
+            nargs='?',
+            const='',
+            dest='worker_threads',
+            help="[setting] packets each transport worker runs at once "
+                 "(default: 4)"
+            )
+
+        parser.add_argument(
+            '--asana-url',
+            action='store',
+            nargs='?',
+            const='',
+            dest='asana_url',
+            help="[setting] base url of the asana api, such as a local stub "
+                 "server"
+            )
+
+        parser.add_argument(
+            '--github-url',
+            action='store',
+            nargs='?',
+            const='',
+            dest='github_url',
+            help="[setting] base url of the github api, such as a local stub "
+                 "server"
+            )
+
+        parser.add_argument(
+            '--cache-ttl',
+            type=int,
+            action='store',
+            nargs='?',
+            const='',
+            dest='cache_ttl',
+            help="[setting] seconds users, repositories and projects stay "
+                 "cached (default: 86400)"
+            )
+
+        parser.add_argument(
+            '--retry-policies',
+            type=json.loads,
+            action='store',
+            nargs='?',
+            const='',
+            dest='retry_policies',
+            help="[setting] json retry policies by error class, e.g. "
+                 "'{\"server\": {\"tries\": 8, \"base\": 1, \"cap\": 60}}'"
+            )
+
     def get_repo_and_project(self):
         """Returns repository and project."""
         app = self.app
@@ -68,7 +172,7 @@ class Action(object):
         # Get repo
         repo = app.data.apply('github-repo', app.args.github_repo,
             app.prompt_repo,
-            on_load=app.github.get_repo,
+            on_load=app.get_repo,
             on_save=lambda r: r.id
             )
 
@@ -77,7 +181,7 @@ class Action(object):
         # Get project
         project = app.data.apply('asana-project', app.args.asana_project,
             app.prompt_project,
-            on_load=app.asana.projects.find_by_id,
+            on_load=app.get_project,
             on_save=lambda p: p['id']
             )
 
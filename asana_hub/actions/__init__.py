@@ -1,7 +1,3 @@
 """actions module contains all actions."""
 
-import os
-import glob
-
-modules = glob.glob(os.path.dirname(__file__)+"/*.py")
-__all__ = [ os.path.basename(f)[:-3] for f in modules]
+__all__ = ['connect', 'export', 'issue', 'pull_request', 'sync', 'verify']
@@ -0,0 +1,165 @@
+"""
+export action
+
+Exports the issue and task mapping of local data as jsonl or csv.
+
+"""
+
+import csv
+import json
+import logging
+import sys
+
+from ..action import Action
+
+NAMESPACES = ('open', 'closed')
+"""Namespaces of issue data."""
+
+FIELDS = ('issue', 'namespace', 'tasks', 'tags', 'pull_requests')
+"""Fields of an exported row."""
+
+class Export(Action):
+    """Exports the issue/task mapping of local data as jsonl or csv."""
+
+    # name of action
+    name = "export"
+
+    # reads local data only
+    requires_auth = False
+
+    @classmethod
+    def add_arguments(cls, parser):
+        """Add arguments to the parser for collection in app.args.
+
+        Args:
+            parser:
+                `argparse.ArgumentParser`. Parser.
+                Arguments added here are server on
+                self.args.
+        """
+
+        parser.add_argument(
+            '--format',
+            action='store',
+            choices=('jsonl', 'csv'),
+            default='jsonl',
+            dest='export_format',
+            help="[export] output format (default: jsonl)",
+            )
+
+        parser.add_argument(
+            '--output',
+            action='store',
+            dest='output',
+            help="[export] file to write rows to (default: stdout)",
+            )
+
+        parser.add_argument(
+            '--namespace',
+            action='store',
+            choices=NAMESPACES,
+            dest='namespace',
+            help="[export] only export open or closed issues",
+            )
+
+        parser.add_argument(
+            '--from-issue',
+            type=int,
+            action='store',
+            dest='from_issue',
+            help="[export] only export issues [FROM_ISSUE] and above",
+            )
+
+        parser.add_argument(
+            '--to-issue',
+            type=int,
+            action='store',
+            dest='to_issue',
+            help="[export] only export issues [TO_ISSUE] and below",
+            )
+
+    def iter_rows(self, namespaces=NAMESPACES, from_issue=None,
+                  to_issue=None):
+        """Yields a row per issue of local data, by namespace and issue.
+
+        Args:
+            namespaces:
+                `tuple`. Namespaces to export.
+            from_issue:
+                `int`. Lowest issue number exported, if set.
+            to_issue:
+                `int`. Highest issue number exported, if set.
+        """
+        app = self.app
+        task_data = app.data.get(app._task_data_key()) or {}
+
+        for namespace in namespaces:
+            issue_data = app.data.get(app._issue_data_key(namespace)) or {}
+
+            for issue_number in sorted(issue_data, key=int):
+                number = int(issue_number)
+                if from_issue is not None and number < from_issue:
+                    continue
+                if to_issue is not None and number > to_issue:
+                    continue
+
+                data = issue_data[issue_number]
+                tasks = data.get('tasks') or []
+
+                tags = []
+                for task_id in tasks:
+                    for tag_id in task_data.get(str(task_id), {}).get(
+                            'tags') or []:
+                        if tag_id not in tags:
+                            tags.append(tag_id)
+
+                yield {
+                    'issue': number,
+                    'namespace': namespace,
+                    'tasks': tasks,
+                    'tags': tags,
+                    'pull_requests': data.get('pull_requests') or [],
+                }
+
+    def write_jsonl(self, rows, file):
+        count = 0
+        for row in rows:
+            file.write(json.dumps(row, sort_keys=True) + "\n")
+            count += 1
+        return count
+
+    def write_csv(self, rows, file):
+        """Writes rows as csv, with lists space separated."""
+        writer = csv.writer(file)
+        writer.writerow(FIELDS)
+
+        count = 0
+        for row in rows:
+            writer.writerow([
+                " ".join(str(value) for value in row[field])
+                if isinstance(row[field], list) else row[field]
+                for field in FIELDS])
+            count += 1
+        return count
+
+    def run(self):
+        app = self.app
+
+        namespaces = NAMESPACES
+        if app.args.namespace:
+            namespaces = (app.args.namespace,)
+
+        rows = self.iter_rows(namespaces,
+                              from_issue=app.args.from_issue,
+                              to_issue=app.args.to_issue)
+
+        write = getattr(self, 'write_%s' % app.args.export_format)
+
+        if app.args.output:
+            with open(app.args.output, 'wb') as file:
+                count = write(rows, file)
+        else:
+            count = write(rows, sys.stdout)
+            sys.stdout.flush()
+
+        logging.info("exported %d issues", count)
@@ -5,16 +5,33 @@ Creates a new github issue and asana task.
 
 """
 
+import csv
+import json
 import logging
+import os
+
+from .. import fields
+from .. import transport
 
 from ..action import Action
 
+MAX_IN_FLIGHT = 50
+"""Maximum imported records queued on the transport at once."""
+
+CHECKPOINT_INTERVAL = 100
+"""Import progress is saved to the data file every this many records."""
+
 class Issue(Action):
     """Creates a new github issue and asana task."""
 
     # name of action
     name = "issue"
 
+    @property
+    def interactive(self):
+        # Bulk imports don't need the interactive lane.
+        return not self.args.import_file
+
     @classmethod
     def add_arguments(cls, parser):
         """Add arguments to the parser for collection in app.args.
@@ -44,13 +61,98 @@ class Issue(Action):
             help="[issue] task/issue body.",
             )
 
-        pass
+        parser.add_argument(
+            '--import',
+            action='store',
+            dest='import_file',
+            help="[issue] jsonl or csv file of title/body records to import",
+            )
+
+    def iter_records(self, filename):
+        """Yields title/body records from a jsonl or csv file."""
+
+        with open(filename, 'rb') as file:
+            if filename.lower().endswith('.csv'):
+                for record in csv.DictReader(file):
+                    yield dict((key, value.decode('utf-8'))
+                               for key, value in record.iteritems()
+                               if key and value is not None)
+            else:
+                for line in file:
+                    if line.strip():
+                        yield json.loads(line)
+
+    def run_import(self, filename, project):
+        """Imports records as asana tasks and github issues.
+
+        Each record goes through the transport as a pipeline: its task is
+        created, then its issue, linked to the task, then a story linking
+        the task back to the issue. Records of the file overlap in the
+        workers. Progress is kept in the `import-progress` data, so an
+        interrupted import resumes where it stopped; records with packets
+        replayed from the journal are left to those packets.
+        """
+        app = self.app
+
+        source = os.path.abspath(filename)
+        progress = app.data.get('import-progress', {}).get(source, {})
+        replayed = set(
+            packet['index'] for packet in transport.replayed
+            if packet['task'] in ('import_task', 'import_issue') and
+            packet['source'] == source)
+
+        queued = skipped = 0
+        for index, record in enumerate(self.iter_records(filename)):
+            title = record.get('title')
+            assert title, "record %d has no title" % index
+
+            body = record.get('body') or ''
+            done = progress.get(str(index), {})
+
+            if done.get('issue') or index in replayed:
+                skipped += 1
+                continue
+
+            if done.get('task_id'):
+                # Task created by an interrupted import, issue missing.
+                transport.put("import_issue",
+                              source=source,
+                              index=index,
+                              title=title,
+                              body=body,
+                              task_id=done['task_id'])
+            else:
+                transport.put("import_task",
+                              source=source,
+                              index=index,
+                              title=title,
+                              body=body,
+                              asana_workspace_id=project['workspace']['id'],
+                              projects=[project['id']])
+            queued += 1
+
+            # Keep a bounded number of records in flight.
+            transport.flush(limit=MAX_IN_FLIGHT)
+
+            if queued % CHECKPOINT_INTERVAL == 0:
+                app.flush_settings()
+                with app.data_lock:
+                    app.data.save()
+                logging.info("importing: %d records queued", queued)
+
+        app.flush()
+
+        logging.info("imported %d records, %d already imported",
+                     queued, skipped)
 
     def run(self):
         app = self.app
 
         repo, project = self.get_repo_and_project()
 
+        if app.args.import_file:
+            return self.run_import(app.args.import_file, project)
+
         # Collect title and body
         title = app.settings.apply(None, app.args.title,
             "task/issue title",
@@ -72,7 +174,7 @@ class Issue(Action):
             # TODO: Correct assignee.
             'assignee': 'me',
             'projects': [project['id']]
-            })
+            }, **fields.asana('write'))
 
         asana_task_id = task['id']
         asana_task_url = app.make_asana_url(project['id'], asana_task_id)
@@ -91,7 +193,14 @@ class Issue(Action):
             )
 
         # Create asana comment (story)
-        app.announce_issue_to_task(asana_task_id, issue)
+        transport.put("create_story",
+            task_id=asana_task_id,
+            text="Git Issue #%d: \n"
+                  "%s" % (
+                    issue.number,
+                    issue.html_url,
+                    )
+            )
 
         logging.info("github issue #%d created:\n%s\n",
             issue.number, issue.html_url)
@@ -6,14 +6,33 @@ Creates a new github issue and asana task.
 """
 
 import logging
+import re
+
+from multiprocessing.pool import ThreadPool
+
+from .. import transport
 
 from ..action import Action
 
+MAX_FETCHES = 8
+"""Maximum issues fetched from github at once."""
+
+FIXES_RE = re.compile(r'^Fixes #\d+ - .*\n?', re.M)
+"""Matches the `Fixes` lines written to a pull request body."""
+
+ASANA_TASKS_RE = re.compile(
+    r'^## Asana Tasks\n(\n? \* \[#\d+\]\(\S*\))*\n?', re.M)
+"""Matches the asana tasks section written to a pull request body."""
+
+GENERATED_TITLE_RE = re.compile(r'^Fixes #\d+(, #\d+)*$')
+"""Matches the title written to a pull request fixing several issues."""
+
 class PullRequest(Action):
     """Creates a new github pull-request for an exist issue and a branch."""
 
     # name of action
     name = "pr"
+    interactive = True
 
     @classmethod
     def add_arguments(cls, parser):
@@ -32,7 +51,7 @@ class PullRequest(Action):
             nargs='?',
             const='',
             dest='issue',
-            help="[pr] issue #",
+            help="[pr] issue #, or several as 12,14,15",
             )
 
         parser.add_argument(
@@ -54,84 +73,200 @@ class PullRequest(Action):
             help="[pr] name of branch to pull changes into\n(defaults to: master)",
             )
 
-    def run(self):
+    def find_pull_request(self, repo, branch):
+        """Returns the open pull request from a branch, or `None`."""
+        head = branch if ':' in branch else \
+            "%s:%s" % (repo.owner.login, branch)
+
+        try:
+            pull_requests = repo.get_pulls(state="open", head=head)
+        except TypeError:
+            # PyGithub before 1.29 can't filter by head; scan them all.
+            pull_requests = (
+                pull_request for pull_request in repo.get_pulls(state="open")
+                if branch in (pull_request.head.ref, pull_request.head.label))
+
+        for pull_request in pull_requests:
+            return pull_request
+
+        return None
+
+    def linked_issue_numbers(self, pull_request_number):
+        """Returns the numbers of issues recorded as fixed by a pull request.
+
+        Args:
+            pull_request_number:
+                `int`. Github pull request number.
+        """
         app = self.app
 
-        repo, project = self.get_repo_and_project()
-        project_id = project['id']
+        numbers = set()
+        for namespace in ('open', 'closed'):
+            issue_data = app.data.get(app._issue_data_key(namespace), {})
+            for issue_number, data in issue_data.iteritems():
+                if pull_request_number in data.get('pull_requests', []):
+                    numbers.add(int(issue_number))
 
-        # Collect title and body
-        issue = app.settings.apply(None, app.args.issue,
-            "issue # to create PR for",
-            )
+        return numbers
 
-        assert issue, "issue required"
-        issue = repo.get_issue(int(issue))
-        assert issue, "issue could not be found"
+    def get_issues(self, repo, issue_numbers):
+        """Fetches several issues from github concurrently."""
+        pool = ThreadPool(min(len(issue_numbers), MAX_FETCHES))
+        try:
+            return pool.map(repo.get_issue, issue_numbers)
+        finally:
+            # Its threads are gone before a worker is forked.
+            pool.close()
+            pool.join()
 
-        branch = app.settings.apply(None, app.args.branch,
-            "branch to create pull-request from [via api]",
-            ) or ''
+    def get_issue_data(self, issue):
+        """Returns the local data of an issue, from whichever namespace
+        holds it."""
+        app = self.app
 
-        # Get issue data to create pull request tasks list.
-        issue_data = app.get_saved_issue_data(issue)
+        if not app.has_saved_issue_data(issue) and \
+                app.has_saved_issue_data(issue, 'closed'):
+            return app.get_saved_issue_data(issue, 'closed')
 
-        issue_tasks = issue_data.get('tasks', [])
-        issue_data['tasks'] = issue_tasks
+        return app.get_saved_issue_data(issue)
 
-        # pull_requests is a list of pull request numbers
-        issue_prs = issue_data.get('pull_requests', [])
-        issue_data['pull_requests'] = issue_prs
+    def describe(self, issues, project_id, pull_request=None):
+        """Returns the title and body of a pull request fixing issues.
 
+        Args:
+            issues:
+                `list`. Github issues fixed by the pull request.
+            project_id:
+                `int`. Asana project ID.
+            pull_request:
+                Existing pull request. Its `Fixes` lines and asana tasks
+                are written again; its title, unless it was generated,
+                and the rest of its body are kept.
+        """
+        app = self.app
+
+        # Get issue data to create pull request tasks list.
         asana_msgs = ''
-        for task in issue_tasks:
-            asana_msgs += '\n * [#%d](%s)' % (
-                task,
-                app.make_asana_url(project_id, task)
-                )
+        for issue in issues:
+            issue_data = self.get_issue_data(issue)
+
+            for task in issue_data.get('tasks', []):
+                asana_msgs += '\n * [#%d](%s)' % (
+                    task,
+                    app.make_asana_url(project_id, task)
+                    )
 
         if asana_msgs:
             asana_msgs = '## Asana Tasks\n' + asana_msgs
 
-        # Create pull request.
-        pull_request = repo.create_pull(
-            title=issue.title,
-            head=branch,
-            base="master",
-            body="Fixes #%d - %s\n"
-                "\n## Testing:\n\n"
-                "%s"
+        if len(issues) == 1:
+            title = issues[0].title
+        else:
+            title = "Fixes %s" % ", ".join(
+                "#%d" % issue.number for issue in issues)
+
+        fixes = "\n".join("Fixes #%d - %s" % (issue.number, issue.title)
+                          for issue in issues)
+
+        if pull_request is None:
+            body = "%s\n" \
+                "\n## Testing:\n\n" \
+                "%s" \
                 "" % (
-                    issue.number,
-                    issue.title,
+                    fixes,
                     asana_msgs,
                     )
+
+            return title, body
+
+        # Keep what was written by hand.
+        if not GENERATED_TITLE_RE.match(pull_request.title) and \
+                pull_request.title not in [issue.title for issue in issues]:
+            title = pull_request.title
+
+        rest = ASANA_TASKS_RE.sub('', FIXES_RE.sub('', pull_request.body or ''))
+        body = "\n\n".join(part for part in
+                           (fixes, rest.strip('\n'), asana_msgs) if part)
+
+        return title, body
+
+    def run(self):
+        app = self.app
+
+        repo, project = self.get_repo_and_project()
+        project_id = project['id']
+
+        # Collect title and body
+        issue_numbers = app.settings.apply(None, app.args.issue,
+            "issue # to create PR for [comma separated for several]",
             )
 
-        # Post asana task.
+        assert issue_numbers, "issue required"
+        issue_numbers = [int(number) for number in
+                         str(issue_numbers).split(',') if number.strip()]
+        assert issue_numbers, "issue required"
+
+        branch = app.settings.apply(None, app.args.branch,
+            "branch to create pull-request from [via api]",
+            ) or ''
+
+        issues = self.get_issues(repo, issue_numbers)
+        for issue_number, issue in zip(issue_numbers, issues):
+            assert issue, "issue #%d could not be found" % issue_number
+
+        # Update the pull request of the branch, or create one.
+        pull_request = self.find_pull_request(repo, branch)
+        if pull_request:
+            # Keep fixing the issues the pull request was made for.
+            linked_numbers = sorted(
+                self.linked_issue_numbers(pull_request.number) -
+                set(issue_numbers))
+            if linked_numbers:
+                issues += self.get_issues(repo, linked_numbers)
+
+            title, body = self.describe(issues, project_id, pull_request)
+            pull_request.edit(title=title, body=body)
+            action = "updated"
+        else:
+            title, body = self.describe(issues, project_id)
+            pull_request = repo.create_pull(
+                title=title,
+                head=branch,
+                base=app.args.target_branch,
+                body=body,
+                )
+            action = "created"
+
+        # Post asana subtasks, for issues new to the pull request.
         title = "PR #%d" % pull_request.number
         body = "%s" % (
             pull_request.html_url
             )
 
-        task_ids = []
-        for task_id in issue_tasks:
-            task = app.asana.tasks.add_subtask(
-                task_id,
-                {
-                'name': title,
-                'notes': body,
-                # TODO: Correct assignee.
-                'assignee': 'me',
-                })
-            task_ids.append(task['id'])
-
-            app.save_issue_data_task(issue.number, task['id'])
-
-        # Add pull request to local data
-        if pull_request.number not in issue_prs:
+        subtasks = 0
+        for issue in issues:
+            issue_data = self.get_issue_data(issue)
+
+            # pull_requests is a list of pull request numbers
+            issue_prs = issue_data.setdefault('pull_requests', [])
+            if pull_request.number in issue_prs:
+                continue
+
+            # Subtasks are appended to the tasks as they are created.
+            for task_id in list(issue_data.get('tasks', [])):
+                transport.put("add_subtask",
+                              task_id=task_id,
+                              name=title,
+                              notes=body,
+                              issue_number=issue.number,
+                              issue_state=issue.state)
+                subtasks += 1
+
+            # Add pull request to local data
             issue_prs.append(pull_request.number)
 
-        logging.info("github pull_request #%d created:\n%s\n",
-            pull_request.number, pull_request.html_url)
+        logging.info("github pull_request #%d %s:\n%s\n",
+            pull_request.number, action, pull_request.html_url)
 
+        if subtasks:
+            logging.info("creating %d asana subtasks", subtasks)
@@ -6,13 +6,22 @@ Syncs completion status of issues and their matched tasks.
 
 """
 
+import json
 import logging
+import math
+import os
 import re
+import time
 import collections
 
+from .. import fields
+from .. import mirror
+from .. import planner
+from .. import shards
 from .. import transport
 
 from ..action import Action
+from ..issues import iter_issues
 
 ASANA_ID_RE = re.compile(r'#(\d{12,16})', re.M)
 """Regular expression for capturing asana IDs."""
@@ -20,12 +29,32 @@ ASANA_ID_RE = re.compile(r'#(\d{12,16})', re.M)
 _ms_label = lambda x: "_ms:%d"%x
 """Converts a milestone id into an _ms prefixed string"""
 
+def _tag_ids(labels, label_tag_map):
+    """Returns the ids of the tags mapped to labels."""
+    return [label_tag_map[label] for label in labels
+            if label in label_tag_map]
+
+ISSUES_PER_PAGE = 30
+"""Issues returned per page of the github issues listing."""
+
+MIRROR_TTL = 300
+"""Default seconds the project mirror is used without a refresh."""
+
+LEASE_TTL = 600
+"""Default seconds a shard lease lasts without renewal."""
+
 class Sync(Action):
     """Syncs completion status of issues and their matched tasks."""
 
     # name of action
     name = "sync"
 
+    def __init__(self, args, app):
+        super(Sync, self).__init__(args, app)
+
+        # Project mirrors loaded by the run, saved once it's done.
+        self.mirrors = []
+
     @classmethod
     def add_arguments(cls, parser):
         """Add arguments to the parser for collection in app.args.
@@ -51,77 +80,652 @@ class Sync(Action):
             help="[sync] sync labels and milestones for each issue"
             )
 
-    def apply_tasks_to_issue(self, issue, tasks, issue_body=None):
+        parser.add_argument(
+            '--manifest',
+            action='store',
+            dest='manifest',
+            help="[sync] json manifest of repo/project pairs to sync together"
+            )
+
+        parser.add_argument(
+            '--plan',
+            action='store_true',
+            dest='plan',
+            help="[sync] print planned operations and api cost, "
+                 "without writing to github or asana"
+            )
+
+        parser.add_argument(
+            '--mirror-ttl',
+            type=int,
+            action='store',
+            nargs='?',
+            const='',
+            dest='mirror_ttl',
+            help="[setting] seconds the project mirror is used before it is "
+                 "refreshed (default: 300)"
+            )
+
+        parser.add_argument(
+            '--deadline',
+            type=int,
+            action='store',
+            dest='deadline',
+            help="[sync] stop after [DEADLINE] seconds, leaving remaining "
+                 "work for the next run"
+            )
+
+        parser.add_argument(
+            '--shards',
+            type=int,
+            action='store',
+            dest='shards',
+            help="[sync] split issues into [SHARDS] ranges, claimed by the "
+                 "nodes sharing --shard-store"
+            )
+
+        parser.add_argument(
+            '--shard-store',
+            action='store',
+            dest='shard_store',
+            help="[sync] SQLite file shared by the nodes of a sharded sync"
+            )
+
+        parser.add_argument(
+            '--shard-run',
+            action='store',
+            dest='shard_run',
+            help="[sync] name of the sharded sync nodes join "
+                 "(default: today's UTC date)"
+            )
+
+        parser.add_argument(
+            '--lease-ttl',
+            type=int,
+            action='store',
+            default=LEASE_TTL,
+            dest='lease_ttl',
+            help="[sync] seconds a node holds a shard without renewing its "
+                 "lease (default: 600)"
+            )
+
+    @property
+    def dry_run(self):
+        return bool(self.args.plan)
+
+    def apply_tasks_to_issue(self, issue, tasks, issue_body=None,
+                             context=None):
         """Applies task numbers to an issue."""
         issue_body = issue_body or issue.body
-        task_numbers = transport.format_task_numbers_with_links(tasks)
+        task_numbers = transport.format_task_numbers_with_links(tasks,
+                                                                context)
         if task_numbers:
             new_body = transport.ASANA_SECTION_RE.sub('', issue_body)
             new_body = new_body + "\n## Asana Tasks:\n\n%s" % task_numbers
             transport.issue_edit(issue,
-                                 body=new_body)
+                                 body=new_body,
+                                 context=context)
             return new_body
 
         return issue_body
 
-    def sync_labels(self, repo):
-        """Creates a local map of github labels/milestones to asana tags."""
+    def get_workspace_tags(self, asana_ws_id, names):
+        """Returns a map of tag names to ids for a workspace, from the
+        workspace tag index of the settings.
+
+        The workspace is only listed when some of `names` are missing from
+        an index older than the cache ttl, or with `--refresh`. When
+        several tags share a name, the first one listed wins.
+        """
+        app = self.app
+
+        with app.data_lock:
+            workspace_index = app.get_workspace_tag_index(asana_ws_id)
+            listed = workspace_index.get('listed')
+            missing = [name for name in names
+                       if name not in workspace_index['tags']]
+
+            if missing and (app.args.refresh or not listed or
+                            time.time() - listed >= app.cache_ttl):
+                logging.info("listing tags of the asana workspace")
+
+                workspace_tags = {}
+                for tag in app.asana.tags.find_by_workspace(asana_ws_id,
+                        **fields.asana('tag_list')):
+                    workspace_tags.setdefault(tag['name'], tag['id'])
+
+                workspace_index['tags'] = workspace_tags
+                workspace_index['listed'] = time.time()
+
+            return dict(workspace_index['tags'])
+
+    def sync_labels(self, repo, asana_ws_id, context=None):
+        """Creates a local map of github labels/milestones to asana tags.
+
+        Labels and milestones missing from the map are matched by name
+        against the tags already in the workspace, and only those without a
+        tag are created, in parallel through the transport.
+        """
 
         logging.info("syncing new github.com labels to tags")
 
         # create label tag map
         ltm = self.app.data.get("label-tag-map", {})
 
-        # loop over labels, if they don't have tags, make them
+        # collect labels and milestones without tags, by tag name
+        missing = collections.OrderedDict()
+
         for label in repo.get_labels():
-            tag_id = ltm.get(label.name, None)
-            if tag_id is None:
+            if ltm.get(label.name, None) is None:
+                missing.setdefault(label.name, ([], label.url))[0].append(
+                    label.name)
 
-                tag = self.app.asana.tags.create(name=label.name,
-                                      workspace=self.asana_ws_id,
-                                      notes="gh: %s" % label.url
-                                      )
+        for ms in repo.get_milestones(state="all"):
+            if ltm.get(_ms_label(ms.id), None) is None:
+                missing.setdefault(ms.title, ([], ms.url))[0].append(
+                    _ms_label(ms.id))
+
+        if not missing:
+            return ltm
+
+        workspace_tags = self.get_workspace_tags(asana_ws_id, missing)
+
+        for name, (labels, url) in missing.iteritems():
+            tag_id = workspace_tags.get(name)
+            if tag_id:
+                logging.info("\t%s => existing tag %d", name, tag_id)
+                for label in labels:
+                    ltm[label] = tag_id
+                continue
+
+            logging.info("\t%s => new tag", name)
+            transport.put("create_tag",
+                          workspace_id=asana_ws_id,
+                          name=name,
+                          notes="gh: %s" % url,
+                          labels=labels,
+                          context=context)
+
+        self.app.data['label-tag-map'] = ltm
 
-                logging.info("\t%s => tag %d", label.name, tag['id'])
-                ltm[label.name] = tag['id']
+        # Wait for new tags to be saved to the map.
+        self.app.flush()
 
-        # loop over milestones, if they don't have tags, make them
-        for ms in repo.get_milestones(state="all"):
-            tag_id = ltm.get(_ms_label(ms.id), None)
-            if tag_id is None:
+        return self.app.data.get('label-tag-map', {})
 
-                tag = self.app.asana.tags.create(name=ms.title,
-                                      workspace=self.asana_ws_id,
-                                      notes="gh: %s" % ms.url
-                                      )
+    def load_mirror(self, project_id):
+        """Returns the refreshed mirror of a project, stored next to the
+        project data."""
+        app = self.app
+
+        ttl = app.settings.apply('mirror-ttl', app.args.mirror_ttl,
+            on_save=int)
+        if ttl is None:
+            ttl = MIRROR_TTL
+
+        project_mirror = mirror.ProjectMirror(app.data.filename + '.mirror',
+                                              project_id)
+        project_mirror.refresh(app.asana, ttl, full=app.args.refresh)
+        project_mirror.save()
+
+        self.mirrors.append(project_mirror)
+        return project_mirror
+
+    def update_completion(self, tasks, completed, project_mirror):
+        """Queues completion updates of tasks, unless the mirror shows the
+        task is already up to date."""
+
+        for task in tasks:
+            if project_mirror.matches(task, completed=completed):
+                continue
+
+            transport.put('update_task',
+                          task_id=task,
+                          params={'completed': completed})
+            project_mirror.record(task, completed=completed)
+
+    def sync_tags(self, tasks, labels, label_tag_map, project_mirror,
+                  context=None):
+        """Queues the tags of labels to be added to tasks, skipping those
+        the mirror shows on a task already."""
+
+        transport.put("sync_tags",
+                      tasks=tasks,
+                      labels=labels,
+                      present_tags=project_mirror.present_tags(tasks),
+                      context=context)
+
+        tag_ids = _tag_ids(labels, label_tag_map)
+        for task in tasks:
+            project_mirror.record_tags(task, tag_ids)
+
+    def settle_marker(self, repo, issue, labels, label_tag_map,
+                      project_mirror, context=None):
+        """Settles the creation marker of an issue whose task is recorded
+        locally, mirroring the task if the marker's run created it."""
+
+        creation_markers = transport.get_markers(context)
+        marker = creation_markers.get(repo.id, issue.number)
+        if not marker:
+            return
+
+        creation_markers.settle(repo.id, issue.number)
+
+        if marker.get('task_id'):
+            project_mirror.record_created(marker['task_id'], issue.html_url,
+                                          bool(issue.closed_at),
+                                          _tag_ids(labels, label_tag_map))
+
+    def load_manifest(self, filename):
+        """Loads a manifest of repo/project pairs.
+
+        The manifest is a json list of objects with `github-repo`,
+        `asana-project` and `data-file` keys, and optionally `first-issue`.
+        Data files are relative to the manifest.
+        """
 
-                logging.info("\t%s => tag %d", ms.title, tag['id'])
-                ltm[_ms_label(ms.id)] = tag['id']
+        with open(filename, 'rb') as file:
+            entries = json.load(file)
 
-        self.app.data['label-tag-map'] = ltm
-        return ltm
+        assert isinstance(entries, list), "manifest must be a list"
+
+        base_dir = os.path.dirname(os.path.abspath(filename))
+        for entry in entries:
+            assert entry.get('data-file'), "manifest entry missing data-file"
+            entry['data-file'] = os.path.join(base_dir, entry['data-file'])
+
+        return entries
+
+    def run_manifest(self, filename):
+        """Syncs every repo/project pair of a manifest.
+
+        All pairs share the app's authenticated transport, and their issues
+        are interleaved round-robin so that no pair starves the others.
+        """
+        app = self.app
+
+        pairs = []
+        for entry in self.load_manifest(filename):
+            data = app.get_context_data(entry)
+
+            with app.data_context(data):
+                repo = data.apply('github-repo', entry.get('github-repo'),
+                    on_load=app.get_repo,
+                    on_save=lambda r: r.id)
+
+                assert repo, "repository not found for %s" % data.filename
+
+                project = data.apply('asana-project',
+                    entry.get('asana-project'),
+                    on_load=app.get_project,
+                    on_save=lambda p: p['id'])
+
+                assert project, "project not found for %s" % data.filename
+
+                data.apply('first-issue', entry.get('first-issue'),
+                    on_save=int)
+
+            context = {
+                'github-repo': repo.id,
+                'asana-project': project['id'],
+                'data-file': data.filename,
+            }
+
+            pairs.append((data, self.iter_sync(repo, project, context)))
+
+        logging.info("syncing %d repositories", len(pairs))
+
+        issues = 0
+        while pairs:
+            for pair in list(pairs):
+                data, steps = pair
+                with app.data_context(data):
+                    try:
+                        next(steps)
+                        issues += 1
+                    except StopIteration:
+                        pairs.remove(pair)
+
+        # Flush work.
+        app.flush()
+
+        return issues
 
     def run(self):
         app = self.app
 
-        repo, project = self.get_repo_and_project()
-        self.asana_ws_id = asana_workspace_id = project['workspace']['id']
+        plan = None
+        if app.args.plan:
+            plan = transport.start_planning()
+        elif app.args.deadline:
+            transport.set_deadline(app.args.deadline)
+
+        if app.args.manifest:
+            issues = self.run_manifest(app.args.manifest)
+            repositories = len(self.load_manifest(app.args.manifest))
+        elif app.args.shard_store and not plan:
+            repo, project = self.get_repo_and_project()
+            issues = self.run_shards(repo, project)
+            repositories = 1
+        else:
+            repo, project = self.get_repo_and_project()
+
+            issues = 0
+            for _ in self.iter_sync(repo, project):
+                issues += 1
+
+            repositories = 1
+
+            # Flush work.
+            app.flush()
+
+        if plan:
+            self.report_plan(plan, issues, repositories)
+        else:
+            # Keep the writes queued by the run for the next.
+            for project_mirror in self.mirrors:
+                project_mirror.save()
+
+    def report_plan(self, plan, issues, repositories):
+        """Logs planned operations, and estimates the api calls and time
+        they would take against the current rate limits.
+
+        Args:
+            plan:
+                `planner.Planner`. Packets put by the sync.
+            issues:
+                `int`. Number of issues synced.
+            repositories:
+                `int`. Number of repositories synced.
+        """
+        app = self.app
+
+        # Reads a real run makes before deciding.
+        pages = int(math.ceil(float(issues) / ISSUES_PER_PAGE))
+        plan.read('github', max(pages, repositories))
+        if app.args.sync_labels:
+            plan.read('github', 2 * repositories)
+            plan.read('asana', repositories)
+
+        logging.info("planned operations for %d issues:", issues)
+        for task, description in planner.OPERATIONS.iteritems():
+            logging.info("\t%s: %d", description, plan.operations[task])
+        logging.info("\ttasks recorded locally: %d",
+                     plan.settings['save_issue_data_task'])
+
+        remaining, limit = app.github.rate_limiting
+        reset_time = app.github.rate_limiting_resettime
+
+        logging.info("estimated api cost:")
+        runtime = 0
+        for service in ('asana', 'github'):
+            concurrency = min(transport.service_limits[service],
+                              transport.worker_bounds[1])
+            if service == 'github':
+                seconds = plan.estimate(service, concurrency,
+                                        remaining=remaining,
+                                        limit=limit,
+                                        reset_time=reset_time)
+                budget = "%d of %d left, resets %s" % (
+                    remaining, limit,
+                    time.strftime("%H:%M", time.localtime(reset_time)))
+            else:
+                seconds = plan.estimate(service, concurrency)
+                budget = "%d per minute" % planner.ASANA_RATE_LIMIT
+
+            logging.info("\t%s: %d calls, ~%ds (%s)",
+                         service, plan.calls[service], seconds, budget)
+            runtime = max(runtime, seconds)
+
+        logging.info("estimated runtime: ~%ds", runtime)
+
+    def run_shards(self, repo, project):
+        """Syncs shards of the repository's issues, claimed from a store
+        shared with other nodes, then merges the data of every completed
+        shard into local data.
+
+        Each node syncs with its own credentials; a shard whose node dies
+        is claimed by another once its lease runs out.
+        """
+        app = self.app
+        args = app.args
+
+        store = shards.ShardStore(args.shard_store, args.lease_ttl)
+        run = args.shard_run or time.strftime('%Y-%m-%d', time.gmtime())
+
+        if args.shards:
+            last_issue = next(iter_issues(repo, state="all"), None)
+            if last_issue is not None:
+                first_issue = app.data.get('first-issue') or 1
+                store.plan(repo.id, run, first_issue, last_issue.number,
+                           args.shards)
+
+        # Start the transport before the lease threads, which must not
+        # exist when it forks.
+        transport.setup()
+
+        issues = 0
+        while not transport.deadline_near():
+            shard = store.claim(repo.id, run)
+            if shard is None:
+                break
+
+            logging.info("syncing shard #%d-#%d of %s", shard.low,
+                         shard.high, run)
+
+            # The lease is renewed until the shard's work is flushed.
+            with store.leased(shard):
+                issues += self.sync_shard(repo, project, shard)
+
+                # Flush work, so the shard's data is complete.
+                app.flush()
+
+            if shard.lost:
+                logging.warning("lost lease of shard #%d-#%d",
+                                shard.low, shard.high)
+                continue
+
+            if transport.deadline_near():
+                store.release(shard)
+                break
+
+            if not store.complete(shard, self.shard_result(shard)):
+                logging.warning("lost lease of shard #%d-#%d before "
+                                "completing it", shard.low, shard.high)
+
+        merged = 0
+        for result in store.iter_results(repo.id, run):
+            self.merge_shard_result(result)
+            merged += 1
+
+        logging.info("merged %d shards of %s, %d left", merged, run,
+                     store.pending(repo.id, run))
+
+        return issues
+
+    def sync_shard(self, repo, project, shard):
+        """Syncs the issues of a shard, until its lease is lost.
+
+        Returns:
+            `int`. Number of issues synced.
+        """
+        issues = 0
+        for _ in self.iter_sync(repo, project,
+                                issue_range=(shard.low, shard.high)):
+            if shard.lost:
+                break
+
+            issues += 1
+
+        return issues
+
+    def shard_result(self, shard):
+        """Returns the local data synced for the issues of a shard."""
+        app = self.app
+
+        task_data = app.data.get(app._task_data_key()) or {}
+        result = {
+            'label-tag-map': app.data.get('label-tag-map') or {},
+            'task-data': {},
+        }
+
+        for namespace in ('open', 'closed'):
+            key = app._issue_data_key(namespace)
+            result[key] = {}
+
+            for issue_number, data in (app.data.get(key) or {}).iteritems():
+                if not shard.low <= int(issue_number) <= shard.high:
+                    continue
+
+                result[key][issue_number] = data
+                for task_id in data.get('tasks') or []:
+                    if str(task_id) in task_data:
+                        result['task-data'][str(task_id)] = \
+                            task_data[str(task_id)]
+
+        return result
+
+    def merge_shard_result(self, result):
+        """Merges the data of a shard into local data, joining the lists of
+        issues and tasks known to both."""
+        app = self.app
+
+        with app.data_lock:
+            for key, entries in result.iteritems():
+                if key == 'label-tag-map':
+                    label_tag_map = app.data.get(key) or {}
+                    label_tag_map.update(entries)
+                    app.data[key] = label_tag_map
+                    continue
+
+                local_entries = app.data.get(key) or {}
+                for entry_key, entry in entries.iteritems():
+                    local_entry = local_entries.setdefault(entry_key, {})
+                    for field, value in entry.iteritems():
+                        if isinstance(value, list):
+                            value = app.uniqify(
+                                (local_entry.get(field) or []) + value)
+                        local_entry[field] = value
+
+                app.data[key] = local_entries
+
+    def create_missing_task(self, repo, project, issue, tasks, labels,
+                            project_mirror, context=None):
+        """Queues the creation of a task for an issue without one.
+
+        Tasks already created for the issue, by a run that never saved them
+        locally, are recovered from its creation marker or the project
+        mirror instead. Markers left pending by a run that stopped are
+        cleared once the mirror shows no task for the issue.
+
+        Returns:
+            `str`. Status of the issue.
+        """
+        creation_markers = transport.get_markers(context)
+        marker = creation_markers.get(repo.id, issue.number)
+
+        if marker and creation_markers.is_stale(marker):
+            # Its run may have created the task after the mirror was
+            # refreshed.
+            if project_mirror.data.get('refreshed', 0) <= marker['time']:
+                project_mirror.refresh(self.app.asana, 0)
+                project_mirror.save()
+
+            creation_markers.clear_stale(repo.id, issue.number, marker)
+            marker = None
+
+        if marker:
+            task_id = marker.get('task_id')
+        else:
+            task_id = project_mirror.issue_task(issue.html_url)
+
+        if task_id:
+            # Created by another run, but never saved locally.
+            transport.put_setting("save_issue_data_task",
+                                  issue=str(issue.number),
+                                  task_id=task_id,
+                                  namespace=issue.state,
+                                  context=context)
+            return "recovered task"
+
+        if marker:
+            return "task creation in flight"
+
+        # Create tasks for non-prs
+        transport.put("create_missing_task",
+                      issue_number=issue.number,
+                      issue_state=issue.state,
+                      issue_html_url=issue.html_url,
+                      issue_body=issue.body,
+                      asana_workspace_id=project['workspace']['id'],
+                      name=issue.title,
+                      # TODO: Correct assignee.
+                      assignee='me',
+                      projects=[project['id']],
+                      completed=bool(issue.closed_at),
+                      tasks=tasks,
+                      labels=labels,
+                      context=context,
+                      )
+
+        return "new task"
+
+    def iter_sync(self, repo, project, context=None, issue_range=None):
+        """Syncs the issues of a repository with a project.
+
+        Yields after each issue, so several repositories can be synced
+        together. Local data is read from and written to `app.data`.
+
+        Args:
+            repo:
+                `github.Repository`. Repository.
+            project:
+                `dict`. Asana project.
+            context:
+                `dict`. Transport context of the repository and project,
+                `None` for the app's own project.
+            issue_range:
+                `tuple`. Lowest and highest issue numbers to sync, in place
+                of `first-issue`.
+        """
+        app = self.app
+
+        asana_workspace_id = project['workspace']['id']
         project_id = project['id']
+        log_prefix = "%s " % repo.name if context else ""
+
+        # Asana's state of the project, to skip writes it already reflects.
+        mirror = self.load_mirror(project_id)
 
         # Sync project labels <-> asana tags
         if app.args.sync_labels:
-            label_tag_map = self.sync_labels(repo)
+            label_tag_map = self.sync_labels(repo, asana_workspace_id,
+                                             context)
         else:
             label_tag_map = {}
 
+        # Packets look labels up in the run context, rather than carrying
+        # the map.
+        transport.publish_context({'label-tag-map': label_tag_map},
+                                  context)
+
         # Iterate over the issues in the opposite state as the namespace
         # we are in. We simply want to toggle these guys.
         logging.info("collecting github.com issues")
 
         # Get the first issue, to limit syncing.
         first_issue = app.data.get('first-issue')
+        last_issue = None
+        if issue_range:
+            first_issue, last_issue = issue_range
 
-        for issue in repo.get_issues(state="all"):
+        for issue in iter_issues(repo, state="all", below=last_issue):
+
+            # Leave the rest of the issues to the next run.
+            if transport.deadline_near():
+                logging.info("%sdeadline near, stopping before issue #%d",
+                             log_prefix, issue.number)
+                break
 
             # bypass issues < `first-issue` setting.
             if (first_issue is not None and
@@ -129,6 +733,10 @@ class Sync(Action):
                 logging.debug("stopping at first-issue: %d", first_issue)
                 break
 
+            # Issues above the range belong to another shard.
+            if last_issue is not None and issue.number > last_issue:
+                continue
+
             issue_number = str(issue.number)
             issue_body = issue.body
             asana_match = ASANA_ID_RE.search(issue_body)
@@ -156,10 +764,10 @@ class Sync(Action):
                 transport.put_setting("save_issue_data_task",
                                       issue=issue_number,
                                       task_id=task_id,
-                                      namespace=issue.state)
+                                      namespace=issue.state,
+                                      context=context)
 
-            my_tasks = recorded_tasks.union(tasks_to_save_to_this_issue)
-            my_tasks = transport.mem.list(my_tasks)
+            my_tasks = list(recorded_tasks.union(tasks_to_save_to_this_issue))
 
             # Determine if there are multiple groups of ASANA TASKS
             # named.
@@ -168,57 +776,55 @@ class Sync(Action):
                 asana_match = None
 
                 issue_body = self.apply_tasks_to_issue(issue, my_tasks,
-                    issue_body=issue_body)
+                    issue_body=issue_body, context=context)
                 status = "minified issue body"
 
             # Sync tags and labels
             labels = set()
             if app.args.sync_labels:
-                for label in issue.get_labels():
-                    labels.add(label.name)
-                if issue.milestone:
-                    labels.add(_ms_label(issue.milestone.id))
+                labels.update(issue.labels)
+                if issue.milestone_id:
+                    labels.add(_ms_label(issue.milestone_id))
 
             # If we have tasks already, this issue is cached.
             if recorded_tasks:
+                # A creation marker is no longer needed once the task is
+                # recorded locally.
+                self.settle_marker(repo, issue, labels, label_tag_map,
+                                   mirror, context)
+
                 # If the body is missing asana tasks, add all those we know
                 # about.
                 if not asana_match:
                     # Add tasks if we have any.
                     if recorded_tasks:
                         issue_body = self.apply_tasks_to_issue(issue, my_tasks,
-                            issue_body=issue_body)
+                            issue_body=issue_body, context=context)
                         status = "updated with asana #s"
 
                 # If the section isn't formatted... let's reformat it.
                 elif not transport.ASANA_SECTION_RE.search(issue_body):
                     issue_body = self.apply_tasks_to_issue(issue, my_tasks,
-                        issue_body=issue_body)
+                        issue_body=issue_body, context=context)
                     status = "reformatted asana tasks"
 
                 # Sync tags/labels
-                transport.put("sync_tags",
-                              tasks=my_tasks,
-                              labels=labels,
-                              label_tag_map=label_tag_map)
+                self.sync_tags(my_tasks, labels, label_tag_map, mirror,
+                               context)
 
-                for task in my_tasks:
-                    transport.put('update_task',
-                                  task_id=task,
-                                  params={'completed': bool(issue.closed_at)})
+                self.update_completion(my_tasks, bool(issue.closed_at),
+                                       mirror)
 
             # tasks named on issue need to be synced
             elif asana_match and issue_named_tasks:
                 status = "connecting tasks"
                 self.apply_tasks_to_issue(issue, my_tasks,
-                    issue_body=issue_body)
+                    issue_body=issue_body, context=context)
 
 
                 # Sync tags/labels
-                transport.put("sync_tags",
-                              tasks=my_tasks,
-                              labels=labels,
-                              label_tag_map=label_tag_map)
+                self.sync_tags(my_tasks, labels, label_tag_map, mirror,
+                               context)
 
                 # Create story
                 transport.put("create_story",
@@ -230,38 +836,18 @@ class Sync(Action):
                             )
                     )
 
-                for task in my_tasks:
-                    transport.put('update_task',
-                                  task_id=task,
-                                  params={'completed': bool(issue.closed_at)})
+                self.update_completion(my_tasks, bool(issue.closed_at),
+                                       mirror)
 
             elif self.args.create_missing_tasks and not issue.pull_request:
-                # missing task
-                # Create tasks for non-prs
-                transport.put("create_missing_task",
-                              issue_number=issue.number,
-                              issue_state=issue.state,
-                              issue_html_url=issue.html_url,
-                              issue_body=issue.body,
-                              asana_workspace_id=asana_workspace_id,
-                              name=issue.title,
-                              # TODO: Correct assignee.
-                              assignee='me',
-                              projects=[project_id],
-                              completed=bool(issue.closed_at),
-                              tasks=my_tasks,
-                              label_tag_map=label_tag_map,
-                              labels=labels,
-                              )
-
-                status = "new task"
+                status = self.create_missing_task(repo, project, issue,
+                    my_tasks, labels, mirror, context)
             else:
                 status = "no task"
 
-            logging.info("\t%d) %s - %s",
-                issue.number, issue.title, status)
+            logging.info("\t%s%d) %s - %s",
+                log_prefix, issue.number, issue.title, status)
 
-        # Flush work.
-        app.flush()
+            yield issue
 
 
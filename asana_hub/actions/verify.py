@@ -0,0 +1,209 @@
+"""
+verify action
+
+Checks the tasks recorded in local data against the asana project.
+
+"""
+
+import logging
+
+from multiprocessing.pool import ThreadPool
+
+from .. import clients
+from .. import fields
+from .. import transport
+
+from ..action import Action
+from ..issues import iter_issues
+
+PAGE_SIZE = 100
+"""Tasks listed per page of the project."""
+
+MAX_FETCHES = 8
+"""Maximum unlisted tasks fetched from asana at once."""
+
+DELETED = "deleted"
+FORBIDDEN = "forbidden"
+OUTSIDE = "outside project"
+SUBTASK = "subtask"
+
+class Verify(Action):
+    """Checks tasks of local data against asana, optionally repairing."""
+
+    # name of action
+    name = "verify"
+
+    @classmethod
+    def add_arguments(cls, parser):
+        """Add arguments to the parser for collection in app.args.
+
+        Args:
+            parser:
+                `argparse.ArgumentParser`. Parser.
+                Arguments added here are server on
+                self.args.
+        """
+
+        parser.add_argument(
+            '--repair',
+            action='store_true',
+            dest='repair',
+            help="[verify] drop deleted tasks from local data, "
+                 "and fix task completion"
+            )
+
+    def get_project_tasks(self, project_id):
+        """Returns a map of task id to completion for a project's tasks,
+        listed in pages."""
+
+        project_tasks = {}
+        for task in self.app.asana.tasks.find_by_project(project_id,
+                page_size=PAGE_SIZE, **fields.asana('task_completion')):
+            project_tasks[task['id']] = task['completed']
+
+        return project_tasks
+
+    def get_closed_issues(self, repo):
+        """Returns the numbers of the repository's closed issues, listed in
+        pages.
+
+        Tasks are recorded under the state their issue had at the time, so
+        only github tells which issues are closed now.
+        """
+        return set(issue.number
+                   for issue in iter_issues(repo, state="closed"))
+
+    def get_task_state(self, task_id):
+        """Returns the state of a task missing from the project listing."""
+        try:
+            task = self.app.asana.tasks.find_by_id(task_id,
+                **fields.asana('task_parent'))
+        except clients.asana_errors.NotFoundError:
+            return DELETED
+        except clients.asana_errors.ForbiddenError:
+            return FORBIDDEN
+
+        # Subtasks recorded before their parent was.
+        if task.get('parent'):
+            return SUBTASK
+
+        return OUTSIDE
+
+    def fetch_all(self, func, task_ids):
+        """Returns `func(task_id)` of several tasks, by task id, calling
+        it concurrently."""
+        if not task_ids:
+            return {}
+
+        pool = ThreadPool(min(len(task_ids), MAX_FETCHES))
+        try:
+            return dict(zip(task_ids, pool.map(func, task_ids)))
+        finally:
+            # Its threads are gone before a worker is forked.
+            pool.close()
+            pool.join()
+
+    def get_task_states(self, recorded, project_tasks):
+        """Returns the state of each recorded task missing from the project
+        listing.
+
+        Subtasks, such as those of pull requests, are recorded with their
+        parent; only the other tasks are fetched.
+        """
+        app = self.app
+
+        task_data = app.data.get(app._task_data_key()) or {}
+        unlisted = set(task_id for _, _, task_id in recorded
+                       if task_id not in project_tasks)
+
+        states = {}
+        for task_id in unlisted:
+            if (task_data.get(str(task_id)) or {}).get('parent'):
+                states[task_id] = SUBTASK
+
+        states.update(self.fetch_all(self.get_task_state,
+                                     sorted(unlisted - set(states))))
+        return states
+
+    def iter_recorded_tasks(self):
+        """Yields issue number, namespace and task id of each recorded
+        task."""
+        app = self.app
+
+        for namespace in ('open', 'closed'):
+            issue_data = app.data.get(app._issue_data_key(namespace)) or {}
+            for issue_number, data in sorted(issue_data.iteritems()):
+                for task_id in data.get('tasks') or []:
+                    yield issue_number, namespace, task_id
+
+    def remove_task(self, issue_number, namespace, task_id):
+        """Removes a task from local data."""
+        app = self.app
+
+        issue_data = app.get_saved_issue_data(issue_number, namespace)
+        issue_data['tasks'].remove(task_id)
+
+        task_data = app.data.get(app._task_data_key()) or {}
+        task_data.pop(str(task_id), None)
+
+    def run(self):
+        app = self.app
+
+        repo, project = self.get_repo_and_project()
+
+        logging.info("collecting asana tasks")
+        project_tasks = self.get_project_tasks(project['id'])
+
+        logging.info("collecting closed github issues")
+        closed_issues = self.get_closed_issues(repo)
+
+        recorded = list(self.iter_recorded_tasks())
+        recorded_ids = set(task_id for _, _, task_id in recorded)
+
+        states = self.get_task_states(recorded, project_tasks)
+
+        deleted = []
+        mis_completed = []
+        for issue_number, namespace, task_id in recorded:
+            if task_id in project_tasks:
+                completed = int(issue_number) in closed_issues
+                if project_tasks[task_id] != completed:
+                    mis_completed.append((issue_number, task_id, completed))
+                continue
+
+            state = states[task_id]
+            if state == DELETED:
+                deleted.append((issue_number, namespace, task_id))
+
+            logging.info("\t%s) #%d - %s", issue_number, task_id, state)
+
+        for issue_number, task_id, completed in mis_completed:
+            logging.info("\t%s) #%d - should be %s", issue_number, task_id,
+                         "completed" if completed else "incomplete")
+
+        orphaned = sorted(set(project_tasks) - recorded_ids)
+        for task_id in orphaned:
+            logging.debug("\t#%d - not linked to an issue", task_id)
+
+        subtasks = states.values().count(SUBTASK)
+        logging.info("verified %d tasks: %d deleted, %d mis-completed, "
+                     "%d subtasks, %d outside the project, "
+                     "%d project tasks without issues",
+                     len(recorded_ids), len(deleted), len(mis_completed),
+                     subtasks, len(states) - len(deleted) - subtasks,
+                     len(orphaned))
+
+        if not app.args.repair:
+            return
+
+        for issue_number, namespace, task_id in deleted:
+            self.remove_task(issue_number, namespace, task_id)
+
+        for issue_number, task_id, completed in mis_completed:
+            transport.put('update_task',
+                          task_id=task_id,
+                          params={'completed': completed})
+
+        app.flush()
+
+        logging.info("repaired %d tasks", len(deleted) + len(mis_completed))
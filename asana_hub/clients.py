@@ -0,0 +1,86 @@
+"""
+api clients
+
+Imports the asana and github clients on first use, so that the command line
+can parse arguments and print help without loading the http stack.
+
+"""
+
+import logging
+
+Client = None
+"""`asana.Client`, once loaded."""
+
+asana_errors = None
+"""`asana.error` module, once loaded."""
+
+Github = None
+"""`github.Github`, once loaded."""
+
+GithubException = None
+"""`github.GithubException`, once loaded."""
+
+Repository = None
+"""`github.Repository.Repository`, once loaded."""
+
+connection_errors = ()
+"""Errors raised by either client when a connection fails, once loaded."""
+
+def asana_client(settings):
+    """Returns an asana client for the api key of the settings.
+
+    Requests go to the `asana-url` setting when set, such as a local stub
+    server. The client's `requests` session keeps its connections alive
+    between requests.
+    """
+    client = Client.basic_auth(settings['api-asana'])
+    if settings.get('asana-url'):
+        client.options['base_url'] = settings['asana-url']
+    return client
+
+def github_client(settings):
+    """Returns a github client for the api token of the settings, against
+    the `github-url` setting when set."""
+    if settings.get('github-url'):
+        return Github(settings['api-github'], base_url=settings['github-url'])
+    return Github(settings['api-github'])
+
+def load():
+    """Imports the api clients and sets up SSL, once."""
+    global Client, asana_errors, Github, GithubException, Repository, \
+        connection_errors
+
+    if Client is not None:
+        return
+
+    try:
+        from asana import Client as _Client
+        from asana import error as _asana_errors
+        from github import Github as _Github
+        from github import GithubException as _GithubException
+        from github.Repository import Repository as _Repository
+        import httplib
+        import socket
+        import requests
+
+    except ImportError:
+        raise Exception("Could not import required packages.\n"
+            "Did you pip install -r requirements.txt ?")
+
+    try:
+        import urllib3.contrib.pyopenssl
+        urllib3.contrib.pyopenssl.inject_into_urllib3()
+    except:
+        logging.debug("pyopenssl not detected.\n"
+            "to install pyopenssl: "
+            "pip install pyopenssl ndg-httpsclient pyasn1")
+
+    Client = _Client
+    asana_errors = _asana_errors
+    Github = _Github
+    GithubException = _GithubException
+    Repository = _Repository
+    connection_errors = (requests.exceptions.ConnectionError,
+                         requests.exceptions.Timeout,
+                         httplib.HTTPException,
+                         socket.error)
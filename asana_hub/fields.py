@@ -0,0 +1,43 @@
+"""
+asana field projections
+
+Central table of the fields requested by each asana call, so responses
+only carry what their callers use. The `id` of a resource is always
+returned.
+
+"""
+
+ASANA_FIELDS = {
+    # `ToolApp.asana_me`, to prompt for a workspace.
+    'me': ['workspaces.name'],
+    # projects loaded by `Action.get_repo_and_project`.
+    'project': ['name', 'workspace'],
+    # projects listed by `ToolApp.prompt_project`.
+    'project_list': ['name'],
+    # tasks returned by `ToolApp.get_asana_task`.
+    'task': ['name', 'completed'],
+    # tasks listed by `verify`.
+    'task_completion': ['completed'],
+    # tasks missing from the project, checked by `verify`.
+    'task_parent': ['parent'],
+    # tasks of the project mirror; `notes` are only read for the issue url
+    # they end with.
+    'task_mirror': ['completed', 'tags', 'parent', 'notes'],
+    # tags listed by `sync --sync-labels`.
+    'tag_list': ['name'],
+    # resources created or updated by the transport; only ids are read.
+    'write': ['id'],
+}
+"""Fields of each asana call, by use."""
+
+def asana(use):
+    """Returns the asana client options projecting the fields of a use.
+
+    Args:
+        use:
+            `str`. Key of `ASANA_FIELDS`.
+
+    Returns:
+        `dict`. Keyword options for an `asana.Client` call.
+    """
+    return {'fields': ASANA_FIELDS[use]}
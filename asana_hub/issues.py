@@ -0,0 +1,104 @@
+"""
+streamed github issues
+
+Lists the issues of a repository a page at a time, keeping only the fields
+sync uses, so memory stays flat however many issues a repository has.
+
+"""
+
+class IssueRecord(object):
+
+    """The fields of a github issue used by sync."""
+
+    __slots__ = ('number', 'title', 'body', 'state', 'html_url', 'closed_at',
+                 'pull_request', 'milestone_id', 'labels')
+
+    def __init__(self, issue):
+        """
+        Args:
+            issue:
+                `github.Issue`. Issue of a listing.
+        """
+        self.number = issue.number
+        self.title = issue.title
+        self.body = issue.body or ""
+        self.state = issue.state
+        self.html_url = issue.html_url
+        self.closed_at = issue.closed_at
+
+        # `Issue.pull_request` fetches issues that are not pull requests
+        # again; their urls tell them apart.
+        self.pull_request = '/pull/' in issue.html_url
+
+        milestone = issue.milestone
+        self.milestone_id = milestone.id if milestone else None
+
+        # Labels come with the listing, unlike `Issue.get_labels`.
+        self.labels = [label.name for label in issue.labels or []]
+
+def iter_issues(repo, state="all", below=None):
+    """Yields an `IssueRecord` per issue of a repository, newest first.
+
+    Each page of the listing is dropped once its issues are yielded, where
+    iterating the `PaginatedList` keeps every issue it has fetched.
+
+    Args:
+        repo:
+            `github.Repository`. Repository.
+        state:
+            `str`. State of the issues listed.
+        below:
+            `int`. Skip the pages of issues above this number, rather than
+            listing them.
+    """
+    listing = repo.get_issues(state=state)
+
+    page = listing.get_page(0)
+    page_size = len(page)
+
+    page_number = 0
+    if below is not None and page and page[-1].number > below:
+        page_number, page = _seek(listing, page, below)
+
+    while True:
+        if not page:
+            return
+
+        records = [IssueRecord(issue) for issue in page]
+        del page
+
+        for record in records:
+            yield record
+
+        if len(records) < page_size:
+            return
+
+        page_number += 1
+        page = listing.get_page(page_number)
+
+def _seek(listing, first_page, number):
+    """Returns the number and issues of the last page of a listing
+    starting at or above an issue number.
+
+    Numbers fall by at least one per issue, so issue `number` is at most
+    `top - number` issues in. The page at that bound holds it unless issues
+    are missing; then earlier pages are searched.
+    """
+    page_size = len(first_page)
+    high = (first_page[0].number - number) // page_size
+
+    page = listing.get_page(high)
+    if page and page[0].number >= number:
+        return high, page
+
+    low, found = 0, first_page
+    high -= 1
+    while low < high:
+        middle = (low + high + 1) // 2
+        page = listing.get_page(middle)
+        if page and page[0].number >= number:
+            low, found = middle, page
+        else:
+            high = middle - 1
+
+    return low, found
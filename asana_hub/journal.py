@@ -0,0 +1,221 @@
+"""
+transport journal
+
+Append-only on-disk record of transport packets, so work left in the queue
+by an interrupted run can be replayed by the next one.
+
+Every run journals to its own file, locked while the run is alive, so a run
+only replays the journals of runs that are gone.
+
+"""
+
+import collections
+import errno
+import fcntl
+import json
+import logging
+import os
+import time
+import uuid
+
+ENQUEUED = "enqueued"
+STARTED = "started"
+COMPLETED = "completed"
+
+def _jsonable(value):
+    """Serializes sets and manager proxies as lists."""
+    return list(value)
+
+class Journal(object):
+
+    """Append-only journal of transport packets.
+
+    Every line is a json record holding an `event` (enqueued, started or
+    completed) and the packet `id`. Enqueued records also carry the packet,
+    so packets that never completed can be re-queued.
+    """
+
+    def __init__(self, filename):
+        """
+        Args:
+            filename:
+                Filename for the journal.
+        """
+        self.filename = filename
+        self.lock = None
+
+    @classmethod
+    def new_id(cls):
+        """Returns a new unique packet id."""
+        return uuid.uuid4().hex
+
+    @classmethod
+    def for_run(cls, prefix):
+        """Returns a new journal for the current run.
+
+        Args:
+            prefix:
+                Filename the journals of all runs start with.
+        """
+        return cls("%s.%d-%s" % (prefix, os.getpid(), cls.new_id()[:8]))
+
+    @classmethod
+    def orphans(cls, prefix):
+        """Yields the journals of runs that are gone, locked.
+
+        Journals whose lock is held belong to a live run and are skipped.
+        Orphans must be `discard`ed once their packets are taken over.
+        """
+        dirname, basename = os.path.split(prefix)
+
+        filenames = set()
+        for name in os.listdir(dirname or '.'):
+            if not name.startswith(basename):
+                continue
+            if name.endswith('.lock'):
+                name = name[:-len('.lock')]
+
+            # The journal of a version without per-run journals is named
+            # by the prefix alone.
+            if name == basename or name.startswith(basename + '.') and \
+               not name.endswith('.tmp'):
+                filenames.add(os.path.join(dirname, name))
+
+        for filename in sorted(filenames):
+            journal = cls(filename)
+            if journal.hold(blocking=False):
+                yield journal
+
+    def hold(self, blocking=True):
+        """Locks the journal for the current run, once.
+
+        Returns:
+            `False` if another run holds the journal.
+        """
+        if self.lock is not None:
+            return True
+
+        lock = open(self.filename + '.lock', 'a')
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock, flags)
+        except IOError as exc:
+            lock.close()
+            if exc.errno not in (errno.EAGAIN, errno.EACCES):
+                raise
+            return False
+
+        self.lock = lock
+        return True
+
+    def release(self):
+        """Unlocks the journal, removing its lock file if the journal is
+        gone."""
+        if self.lock is None:
+            return
+
+        if not os.path.exists(self.filename):
+            os.remove(self.filename + '.lock')
+
+        self.lock.close()
+        self.lock = None
+
+    def discard(self):
+        """Removes the journal of a run that is gone, once its packets are
+        taken over."""
+        try:
+            os.remove(self.filename)
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+        self.release()
+
+    def _append(self, record):
+        """Appends a single record as one line.
+
+        Lines are written with a single `write` on a file opened for
+        appending, so records from concurrent workers do not interleave.
+        """
+        line = json.dumps(record, default=_jsonable, sort_keys=True) + "\n"
+        with open(self.filename, 'ab') as file:
+            file.write(line)
+
+    def enqueued(self, packet_id, packet):
+        self.hold()
+        self._append({'event': ENQUEUED, 'id': packet_id, 'packet': packet})
+
+    def started(self, packet_id):
+        self._append({'event': STARTED, 'id': packet_id})
+
+    def completed(self, packet_id):
+        self._append({'event': COMPLETED, 'id': packet_id})
+
+    def iter_records(self):
+        """Yields records from the journal, skipping torn lines."""
+        try:
+            with open(self.filename, 'rb') as file:
+                for line in file:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        logging.debug("skipping torn journal record")
+        except IOError:
+            return
+
+    def pending(self):
+        """Returns an ordered dict of packet id -> packet for every packet
+        that was enqueued but never completed."""
+        packets = collections.OrderedDict()
+        for record in self.iter_records():
+            event = record.get('event')
+            if event == ENQUEUED:
+                packets[record['id']] = record['packet']
+            elif event == COMPLETED:
+                packets.pop(record['id'], None)
+
+        return packets
+
+    def compact(self):
+        """Rewrites the journal with only its unfinished packets.
+
+        Must only be called by the run holding the journal, while none of
+        its workers are running.
+
+        Returns:
+            The pending packets, as returned by `pending`.
+        """
+        packets = self.pending()
+
+        if not packets:
+            if os.path.exists(self.filename):
+                os.remove(self.filename)
+            return packets
+
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'wb') as file:
+            for packet_id, packet in packets.iteritems():
+                file.write(json.dumps({
+                    'event': ENQUEUED,
+                    'id': packet_id,
+                    'packet': packet,
+                    }, default=_jsonable, sort_keys=True) + "\n")
+
+        os.rename(tmp_filename, self.filename)
+        return packets
+
+class DeadLetters(Journal):
+
+    """Append-only record of packets that could not be run.
+
+    Every line is a json record holding the packet `task`, its arguments
+    and the last `error`, for inspection or a manual retry.
+    """
+
+    def added(self, task, packet, error):
+        self._append({
+            'task': task,
+            'packet': packet,
+            'error': error,
+            'time': time.time(),
+            })
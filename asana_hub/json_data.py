@@ -2,7 +2,88 @@
 Maintains JSON based data file manipulated as a dictionary.
 """
 
+import contextlib
+import copy
+import errno
+import fcntl
 import json
+import os
+import time
+
+def merge(base, ours, theirs):
+    """Merges our changes to `base` into `theirs`, another process's
+    changes to it.
+
+    Dictionaries are merged by key, lists are joined, keeping the items
+    either side removed out. Other values changed on both sides take ours.
+
+    Args:
+        base:
+            Value both sides started from, `None` if it was missing.
+        ours:
+            Our value.
+        theirs:
+            Their value.
+    """
+    if isinstance(ours, dict) and isinstance(theirs, dict):
+        return _merge_dicts(base if isinstance(base, dict) else {},
+                            ours, theirs)
+
+    if isinstance(ours, list) and isinstance(theirs, list):
+        return _merge_lists(base if isinstance(base, list) else [],
+                            ours, theirs)
+
+    if ours != base:
+        return ours
+
+    return theirs
+
+def _merge_dicts(base, ours, theirs):
+    """Merges dictionaries by key."""
+    merged = {}
+    for key in set(ours) | set(theirs):
+        if key in ours and key in theirs:
+            merged[key] = merge(base.get(key), ours[key], theirs[key])
+        elif key in ours:
+            # Deleted by them, unless we changed it since.
+            if key not in base or ours[key] != base[key]:
+                merged[key] = ours[key]
+        elif key not in base or theirs[key] != base[key]:
+            merged[key] = theirs[key]
+    return merged
+
+def _merge_lists(base, ours, theirs):
+    """Joins lists, leaving out the items either side removed."""
+    merged = [item for item in theirs
+              if item in ours or item not in base]
+    merged.extend(item for item in ours
+                  if item not in theirs and item not in base)
+    return merged
+
+@contextlib.contextmanager
+def _locked(filename):
+    """Holds an exclusive lock on `<filename>.lock`, removed on release.
+
+    A process that waited on a lock file removed meanwhile locks the new
+    one instead.
+    """
+    lock_filename = filename + '.lock'
+    while True:
+        lock = open(lock_filename, 'a')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            if os.stat(lock_filename).st_ino == os.fstat(lock.fileno()).st_ino:
+                break
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+        lock.close()
+
+    try:
+        yield
+    finally:
+        os.remove(lock_filename)
+        lock.close()
 
 class JSONData(object):
 
@@ -21,11 +102,18 @@ class JSONData(object):
 
         self.filename = filename
 
+        self.data = self.load()
+
+        # Data as loaded, to merge our changes into the file on save.
+        self.loaded = copy.deepcopy(self.data)
+
+    def load(self):
+        """Returns the data of the file, or an empty `dict`."""
         try:
             with open(self.filename, 'rb') as file:
-                self.data = json.load(file)
+                return json.load(file)
         except IOError:
-            self.data = {}
+            return {}
 
     def assert_version(self):
         """Asserts that the version and data file exists."""
@@ -36,14 +124,32 @@ class JSONData(object):
         self.data['version'] = self.version
 
     def save(self):
-        """Save data."""
+        """Save data.
+
+        Other processes may have saved the file since it was loaded, so it
+        is read again under a lock and our changes are merged into it. Data
+        left unchanged since it was loaded is not saved.
+        """
 
-        with open(self.filename, 'wb') as file:
+        if self.data == self.loaded and \
+           self.loaded.get('version') == self.version:
+            return
+
+        with _locked(self.filename):
             self.prune()
+            merged = merge(self.loaded, self.data, self.load())
+            self.data.clear()
+            self.data.update(merged)
             self.data['version'] = self.version
-            json.dump(self.data,
-                file,
-                sort_keys=True, indent=2)
+
+            tmp_filename = "%s.%s.tmp" % (self.filename, os.getpid())
+            with open(tmp_filename, 'wb') as file:
+                json.dump(self.data,
+                    file,
+                    sort_keys=True, indent=2)
+
+            os.rename(tmp_filename, self.filename)
+            self.loaded = copy.deepcopy(self.data)
 
     def __setitem__(self, key, value):
         """Set a value by key."""
@@ -111,6 +217,31 @@ class JSONData(object):
 
         return on_load(self.data[key])
 
+    def cached(self, key, load, ttl, refresh=False):
+        """Returns a value cached under `key` of the `cache` section.
+
+        Args:
+            key:
+                `str`. Cache key.
+            load:
+                callable. Returns the value when it isn't cached, or has
+                expired. The value must be json serializable.
+            ttl:
+                `int`. Seconds a cached value stays fresh.
+            refresh:
+                `bool`. Load the value even if a fresh one is cached.
+        """
+        cache = self.get('cache', {})
+        entry = cache.get(key)
+        now = time.time()
+
+        if entry and not refresh and now - entry['time'] < ttl:
+            return entry['value']
+
+        value = load()
+        cache[key] = {'time': now, 'value': value}
+        return value
+
     def assert_key(self, key):
         assert self.data.get(key), "%s missing from data" % key
 
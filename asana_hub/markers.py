@@ -0,0 +1,203 @@
+"""
+task creation markers
+
+A marker is persisted for a (github repo, issue number) pair before an
+asana task is created for it, so each issue gets at most one task even
+when runs overlap or are replayed.
+
+"""
+
+import errno
+import json
+import os
+import socket
+import threading
+import time
+
+PENDING = "pending"
+CREATED = "created"
+
+PENDING_TTL = 3600
+"""Seconds after which a pending marker is abandoned, even if its owner
+still runs."""
+
+def _pid_alive(pid):
+    """Returns `True` if a process of this host is running."""
+    try:
+        os.kill(pid, 0)
+    except OSError as exc:
+        return exc.errno == errno.EPERM
+    return True
+
+class CreationMarkers(object):
+
+    """Directory of task creation markers.
+
+    A marker is `pending` from the moment it is claimed until the task is
+    created, after which it is `created` and records the `task_id`.
+
+    Markers are owned by a process; the threads of a process take turns
+    through `claiming`.
+    """
+
+    def __init__(self, dirname):
+        """
+        Args:
+            dirname:
+                Directory holding the markers.
+        """
+        self.dirname = dirname
+        self.settled = []
+        self.lock = threading.Lock()
+        self.claiming = set()
+
+    @property
+    def owner(self):
+        """Identifies the current process as owner of its claims."""
+        return "%s:%d" % (socket.gethostname(), os.getpid())
+
+    def filename(self, repo_id, issue_number):
+        """Returns the filename of a marker."""
+        return os.path.join(self.dirname, "%s-%s" % (repo_id, issue_number))
+
+    def get(self, repo_id, issue_number):
+        """Returns a marker as a dict, or `None` if there isn't one."""
+        try:
+            with open(self.filename(repo_id, issue_number), 'rb') as file:
+                return json.load(file)
+        except IOError:
+            return None
+        except ValueError:
+            # Claimed, but not written yet.
+            try:
+                claimed = os.path.getmtime(self.filename(repo_id, issue_number))
+            except OSError:
+                return None
+            return {'state': PENDING, 'time': claimed}
+
+    def is_stale(self, marker):
+        """Returns `True` for a pending marker whose creation was
+        abandoned: its owner process is gone, or it is older than
+        `PENDING_TTL`.
+
+        The task may or may not have been created before the owner
+        stopped.
+        """
+        if marker.get('state') != PENDING:
+            return False
+
+        if time.time() - marker.get('time', 0) >= PENDING_TTL:
+            return True
+
+        owner = marker.get('owner')
+        if not owner:
+            return False
+
+        host, pid = owner.split(':')[:2]
+        return host == socket.gethostname() and not _pid_alive(int(pid))
+
+    def claim(self, repo_id, issue_number):
+        """Atomically claims the creation of a task for an issue.
+
+        Returns:
+            `True` if the caller may create the task, until it calls
+            `unclaim`. A pending marker already owned by this process may
+            be claimed again, so the creation can be retried, but not while
+            another thread holds the claim.
+        """
+        with self.lock:
+            if (repo_id, issue_number) in self.claiming:
+                return False
+
+            claimed = self._claim(repo_id, issue_number)
+            if claimed:
+                self.claiming.add((repo_id, issue_number))
+
+            return claimed
+
+    def _claim(self, repo_id, issue_number):
+        filename = self.filename(repo_id, issue_number)
+
+        try:
+            os.makedirs(self.dirname)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+        try:
+            fd = os.open(filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+
+            marker = self.get(repo_id, issue_number) or {}
+            return (marker.get('state') == PENDING and
+                    marker.get('owner') == self.owner)
+
+        with os.fdopen(fd, 'wb') as file:
+            json.dump({
+                'state': PENDING,
+                'owner': self.owner,
+                'time': time.time(),
+                }, file)
+
+        return True
+
+    def unclaim(self, repo_id, issue_number):
+        """Ends the claim of the current thread, once its creation
+        succeeded or failed."""
+        with self.lock:
+            self.claiming.discard((repo_id, issue_number))
+
+    def created(self, repo_id, issue_number, task_id):
+        """Records the task created for a claimed marker."""
+        filename = self.filename(repo_id, issue_number)
+        tmp_filename = "%s.%s.tmp" % (filename, os.getpid())
+
+        with open(tmp_filename, 'wb') as file:
+            json.dump({
+                'state': CREATED,
+                'owner': self.owner,
+                'time': time.time(),
+                'task_id': task_id,
+                }, file)
+
+        os.rename(tmp_filename, filename)
+
+    def release(self, repo_id, issue_number):
+        """Removes a pending marker claimed by this process, so a later run
+        may create the task."""
+        marker = self.get(repo_id, issue_number) or {}
+        if marker.get('state') == PENDING and \
+           marker.get('owner') == self.owner:
+            self.clear(repo_id, issue_number)
+
+    def clear_stale(self, repo_id, issue_number, marker):
+        """Removes a stale marker, unless it was claimed again since it
+        was read."""
+        current = self.get(repo_id, issue_number)
+        if current == marker:
+            self.clear(repo_id, issue_number)
+
+    def clear(self, repo_id, issue_number):
+        """Removes a marker, if present."""
+        try:
+            os.remove(self.filename(repo_id, issue_number))
+        except OSError as exc:
+            if exc.errno != errno.ENOENT:
+                raise
+
+    def settle(self, repo_id, issue_number):
+        """Schedules a marker for removal by `clear_settled`.
+
+        Markers are settled once their task is recorded in local data, and
+        should only be cleared after that data has been saved.
+        """
+        self.settled.append((repo_id, issue_number))
+
+    def clear_settled(self):
+        """Removes all settled markers."""
+        for repo_id, issue_number in self.settled:
+            self.clear(repo_id, issue_number)
+
+        self.settled = []
@@ -0,0 +1,197 @@
+"""
+project mirror
+
+Local copy of the state of an asana project's tasks, so sync can skip
+writes asana already reflects.
+
+"""
+
+import json
+import logging
+import os
+import re
+import time
+
+from . import fields
+
+PAGE_SIZE = 100
+"""Tasks listed per page."""
+
+FULL_REFRESH_INTERVAL = 86400
+"""Seconds after which the mirror is listed in full again, rather than
+incrementally, to forget tasks deleted from the project."""
+
+CLOCK_SKEW = 60
+"""Seconds subtracted from the last refresh when asking for tasks modified
+since, to allow for clock differences with asana."""
+
+ISSUE_NOTES_RE = re.compile(r'\n\nGit Issue #\d+: (\S+)\s*$')
+"""Regular expression capturing the issue url that ends the notes of a task
+created for an issue."""
+
+def issue_notes(issue_body, issue_number, issue_html_url):
+    """Returns the notes of a task created for an issue, ending with the
+    issue's url so the mirror can match the task to its issue."""
+    return "%s\n\nGit Issue #%d: %s" % (issue_body, issue_number,
+                                        issue_html_url)
+
+class ProjectMirror(object):
+
+    """Mirror of the tasks of an asana project.
+
+    Every task is kept as its `completed` flag, its `tags` ids, the id of
+    its `parent`, and the url of the issue it was created for. The mirror is
+    refreshed by listing the project in pages, or incrementally with the
+    tasks modified since the last refresh.
+
+    Writes queued by a run are recorded as `queued` until a refresh lists
+    their task again; a task whose write never landed isn't listed, and is
+    dropped from the mirror instead.
+    """
+
+    def __init__(self, filename, project_id):
+        """
+        Args:
+            filename:
+                Filename of the mirror.
+            project_id:
+                `int`. Id of the mirrored project.
+        """
+        self.filename = filename
+        self.project_id = project_id
+
+        try:
+            with open(self.filename, 'rb') as file:
+                self.data = json.load(file)
+        except (IOError, ValueError):
+            self.data = {}
+
+        if self.data.get('project') != project_id:
+            self.data = {'project': project_id, 'tasks': {}}
+
+        self.data.setdefault('issues', {})
+
+    @property
+    def tasks(self):
+        """Tasks of the mirror, by task id as a string."""
+        return self.data['tasks']
+
+    def _store(self, task):
+        self.tasks[str(task['id'])] = {
+            'completed': task.get('completed'),
+            'tags': [tag['id'] for tag in task.get('tags') or []],
+            'parent': (task.get('parent') or {}).get('id'),
+        }
+
+        match = ISSUE_NOTES_RE.search(task.get('notes') or "")
+        if match:
+            self.data['issues'][match.group(1)] = task['id']
+
+    def refresh(self, asana, ttl, full=False):
+        """Refreshes the mirror, unless it is fresher than `ttl` seconds.
+
+        Args:
+            asana:
+                `asana.Client`. Client.
+            ttl:
+                `int`. Seconds the mirror stays fresh.
+            full:
+                `bool`. List the whole project, even if the mirror is fresh.
+        """
+        now = time.time()
+        refreshed = self.data.get('refreshed')
+        listed = self.data.get('listed')
+
+        if not full and refreshed and now - refreshed < ttl:
+            return
+
+        options = dict(fields.asana('task_mirror'), page_size=PAGE_SIZE)
+
+        if full or not listed or now - listed >= FULL_REFRESH_INTERVAL:
+            logging.info("mirroring asana project")
+            self.data['tasks'] = {}
+            self.data['issues'] = {}
+            tasks = asana.tasks.find_by_project(self.project_id, **options)
+            self.data['listed'] = now
+        else:
+            modified_since = time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                time.gmtime(refreshed - CLOCK_SKEW))
+            logging.debug("mirroring asana tasks modified since %s",
+                          modified_since)
+            tasks = asana.tasks.find_all({
+                'project': self.project_id,
+                'modified_since': modified_since,
+                }, **options)
+
+        count = 0
+        for task in tasks:
+            self._store(task)
+            count += 1
+
+        for task_id, task in self.tasks.items():
+            if task.get('queued'):
+                del self.tasks[task_id]
+
+        logging.debug("mirrored %d tasks", count)
+        self.data['refreshed'] = now
+
+    def save(self):
+        """Saves the mirror."""
+        tmp_filename = "%s.%s.tmp" % (self.filename, os.getpid())
+        with open(tmp_filename, 'wb') as file:
+            json.dump(self.data, file)
+
+        os.rename(tmp_filename, self.filename)
+
+    def matches(self, task_id, **values):
+        """Returns `True` if a mirrored task has all of the given values."""
+        task = self.tasks.get(str(task_id))
+        if task is None:
+            return False
+
+        for key, value in values.iteritems():
+            if task.get(key) != value:
+                return False
+
+        return True
+
+    def record(self, task_id, **values):
+        """Records values written to a mirrored task by a queued packet.
+
+        Tasks missing from the mirror stay missing, so their writes are
+        never skipped.
+        """
+        task = self.tasks.get(str(task_id))
+        if task is not None:
+            task.update(values, queued=True)
+
+    def record_tags(self, task_id, tag_ids):
+        """Records tags added to a mirrored task by queued packets."""
+        task = self.tasks.get(str(task_id))
+        if task is not None:
+            self.record(task_id, tags=sorted(set(task['tags'] + tag_ids)))
+
+    def record_created(self, task_id, issue_html_url, completed, tag_ids):
+        """Records a task created for an issue, before a refresh lists
+        it."""
+        self.tasks.setdefault(str(task_id), {
+            'completed': completed,
+            'tags': sorted(set(tag_ids)),
+            'parent': None,
+            'queued': True,
+        })
+        self.data['issues'].setdefault(issue_html_url, task_id)
+
+    def issue_task(self, issue_html_url):
+        """Returns the id of the task created for an issue, if mirrored."""
+        return self.data['issues'].get(issue_html_url)
+
+    def present_tags(self, task_ids):
+        """Returns the tag ids of mirrored tasks, by task id as a string."""
+        present = {}
+        for task_id in task_ids:
+            task = self.tasks.get(str(task_id))
+            if task is not None:
+                present[str(task_id)] = task['tags']
+
+        return present
@@ -0,0 +1,257 @@
+"""
+transport packets
+
+Typed packets of the transport. Every packet type declares its fields, which
+are checked when the packet is put, so malformed packets fail where they are
+made. Packets cross processes as compact tuples; values shared by a whole
+run, like the label/tag map, come from the transport's run context instead.
+
+"""
+
+import json
+
+NUMBER = (int, long)
+TEXT = basestring
+LIST = (list, tuple, set, frozenset)
+DICT = dict
+FLAG = (bool, int)
+
+class InvalidPacket(Exception):
+    """Raised for a packet that doesn't match its type."""
+
+def _slots(fields):
+    return tuple(field[0] for field in fields)
+
+class Packet(object):
+
+    """Base of packet types.
+
+    `fields` lists a `(name, types)` pair per required field, and a
+    `(name, types, default)` triple per optional one. `key` names the
+    fields identifying the packet's target, so packets doing the same work
+    can be told apart from others. Packets without `replay` are dropped,
+    rather than replayed, when their run is interrupted.
+    """
+
+    __slots__ = ()
+
+    task = None
+    fields = ()
+    key = ()
+    replay = True
+
+    def __init__(self, **values):
+        for field in self.fields:
+            name, types = field[:2]
+
+            if name in values:
+                value = values.pop(name)
+            elif len(field) > 2:
+                value = field[2]
+            else:
+                raise InvalidPacket("%s packet missing %s" % (self.task, name))
+
+            if value is not None and not isinstance(value, types) or \
+               value is None and len(field) == 2:
+                raise InvalidPacket("%s packet has invalid %s: %r" %
+                                    (self.task, name, value))
+
+            setattr(self, name, value)
+
+        if values:
+            raise InvalidPacket("%s packet has unknown fields: %s" %
+                                (self.task, ", ".join(sorted(values))))
+
+    def arguments(self):
+        """Returns the fields as keyword arguments of the packet's
+        handler."""
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def idempotency_key(self):
+        """Returns a `str` equal for packets of the same task and target,
+        or `None` for packets without a `key`."""
+        if not self.key:
+            return None
+
+        return json.dumps([self.task] + [getattr(self, name)
+                                         for name in self.key],
+                          default=list, sort_keys=True)
+
+    def as_dict(self):
+        """Returns the packet as a `dict`, with its `task`."""
+        values = self.arguments()
+        values['task'] = self.task
+        return values
+
+class CreateMissingTask(Packet):
+    task = 'create_missing_task'
+    fields = (
+        ('asana_workspace_id', NUMBER),
+        ('name', TEXT),
+        ('assignee', TEXT),
+        ('projects', LIST),
+        ('completed', FLAG),
+        ('issue_number', NUMBER),
+        ('issue_html_url', TEXT),
+        ('issue_state', TEXT),
+        ('issue_body', TEXT),
+        ('tasks', LIST),
+        ('labels', LIST),
+        ('context', DICT, None),
+    )
+    key = ('issue_html_url',)
+    __slots__ = _slots(fields)
+
+class AddTag(Packet):
+    task = 'add_tag'
+    fields = (
+        ('task_id', NUMBER),
+        ('tag_id', NUMBER),
+    )
+    key = ('task_id', 'tag_id')
+    __slots__ = _slots(fields)
+
+class SyncTags(Packet):
+    task = 'sync_tags'
+    fields = (
+        ('tasks', LIST),
+        ('labels', LIST),
+        ('context', DICT, None),
+        ('present_tags', DICT, None),
+    )
+    key = ('tasks', 'labels', 'context')
+    __slots__ = _slots(fields)
+
+class CreateStory(Packet):
+    task = 'create_story'
+    fields = (
+        ('task_id', NUMBER),
+        ('text', TEXT),
+    )
+    key = ('task_id', 'text')
+    __slots__ = _slots(fields)
+
+class IssueEdit(Packet):
+    task = 'issue_edit'
+    fields = (
+        ('issue_number', NUMBER),
+        ('body', TEXT),
+        ('context', DICT, None),
+    )
+    key = ('issue_number', 'body', 'context')
+    # The body would replace edits made to the issue since; sync builds
+    # the edit again from the issue's current body.
+    replay = False
+    __slots__ = _slots(fields)
+
+class ApplyTasksToIssue(Packet):
+    task = 'apply_tasks_to_issue'
+    fields = (
+        ('tasks', LIST),
+        ('issue_number', NUMBER),
+        ('issue_body', TEXT),
+        ('context', DICT, None),
+    )
+    key = ('tasks', 'issue_number', 'issue_body', 'context')
+    replay = False
+    __slots__ = _slots(fields)
+
+class UpdateTask(Packet):
+    task = 'update_task'
+    fields = (
+        ('task_id', NUMBER),
+        ('params', DICT),
+    )
+    key = ('task_id', 'params')
+    __slots__ = _slots(fields)
+
+class CreateTag(Packet):
+    task = 'create_tag'
+    fields = (
+        ('workspace_id', NUMBER),
+        ('name', TEXT),
+        ('notes', TEXT),
+        ('labels', LIST),
+        ('context', DICT, None),
+    )
+    key = ('workspace_id', 'name')
+    __slots__ = _slots(fields)
+
+class AddSubtask(Packet):
+    task = 'add_subtask'
+    fields = (
+        ('task_id', NUMBER),
+        ('name', TEXT),
+        ('notes', TEXT, None),
+        ('issue_number', NUMBER),
+        ('issue_state', TEXT),
+    )
+    key = ('task_id', 'name')
+    __slots__ = _slots(fields)
+
+class ImportTask(Packet):
+    task = 'import_task'
+    fields = (
+        ('source', TEXT),
+        ('index', NUMBER),
+        ('title', TEXT),
+        ('body', TEXT),
+        ('asana_workspace_id', NUMBER),
+        ('projects', LIST),
+    )
+    key = ('source', 'index')
+    __slots__ = _slots(fields)
+
+class ImportIssue(Packet):
+    task = 'import_issue'
+    fields = (
+        ('source', TEXT),
+        ('index', NUMBER),
+        ('title', TEXT),
+        ('body', TEXT),
+        ('task_id', NUMBER),
+        ('context', DICT, None),
+    )
+    key = ('source', 'index')
+    __slots__ = _slots(fields)
+
+PACKET_TYPES = dict((packet_type.task, packet_type) for packet_type in (
+    CreateMissingTask,
+    AddTag,
+    SyncTags,
+    CreateStory,
+    IssueEdit,
+    ApplyTasksToIssue,
+    UpdateTask,
+    CreateTag,
+    AddSubtask,
+    ImportTask,
+    ImportIssue,
+))
+"""Packet types, by task."""
+
+def make(task, values):
+    """Returns a packet of a task, checked against its type.
+
+    Raises:
+        `InvalidPacket` for an unknown task, or fields that don't match.
+    """
+    packet_type = PACKET_TYPES.get(task)
+    if packet_type is None:
+        raise InvalidPacket("unknown packet type: %s" % task)
+
+    return packet_type(**values)
+
+def encode(packet, packet_id):
+    """Returns a packet as a tuple of its task, id and field values."""
+    return (packet.task, packet_id) + tuple(
+        getattr(packet, name) for name in packet.__slots__)
+
+def decode(values):
+    """Returns the id and packet of an encoded packet."""
+    packet_type = PACKET_TYPES[values[0]]
+    packet = packet_type.__new__(packet_type)
+    for name, value in zip(packet_type.__slots__, values[2:]):
+        setattr(packet, name, value)
+
+    return values[1], packet
@@ -0,0 +1,150 @@
+"""
+operation planner
+
+Records the packets an action would put on the transport, without running
+them, and estimates the api calls and time they would take.
+
+"""
+
+import collections
+import math
+import time
+
+OPERATIONS = collections.OrderedDict([
+    ('create_missing_task', "task creations"),
+    ('issue_edit', "issue body edits"),
+    ('add_tag', "tag additions"),
+    ('update_task', "completion updates"),
+    ('create_story', "task stories"),
+    ('create_tag', "tag creations"),
+])
+"""Planned packet types reported, with their descriptions."""
+
+PACKET_CALLS = {
+    'create_missing_task': ('asana', 1),
+    'issue_edit': ('github', 2),
+    'add_tag': ('asana', 1),
+    'update_task': ('asana', 1),
+    'create_story': ('asana', 1),
+    'create_tag': ('asana', 1),
+    'add_subtask': ('asana', 1),
+    'import_task': ('asana', 1),
+    'import_issue': ('github', 1),
+}
+"""Service and number of api calls of each packet type."""
+
+CALL_LATENCY = {
+    'asana': 0.5,
+    'github': 0.5,
+}
+"""Typical seconds per api call of each service."""
+
+ASANA_RATE_LIMIT = 150
+"""Asana requests allowed per minute. Asana doesn't report the remaining
+budget, so the documented limit of free workspaces is assumed."""
+
+GITHUB_RATE_WINDOW = 3600
+"""Seconds after which the github rate limit resets."""
+
+class Planner(object):
+
+    """Plan of the packets put on the transport.
+
+    Packets that would queue others when run (`create_missing_task`,
+    `apply_tasks_to_issue`, `sync_tags`) are expanded as the workers would,
+    so the plan holds every api call of the run.
+    """
+
+    def __init__(self):
+        self.operations = collections.Counter()
+        self.settings = collections.Counter()
+        self.calls = collections.Counter()
+        self.new_tag_labels = set()
+        # published by the transport with the run context
+        self.label_tag_map = {}
+
+    def put(self, task, packet):
+        """Records a packet."""
+        self.operations[task] += 1
+
+        service, calls = PACKET_CALLS.get(task, (None, 0))
+        if service:
+            self.calls[service] += calls
+
+        expand = getattr(self, '_expand_%s' % task, None)
+        if expand:
+            expand(**packet)
+
+    def put_setting(self, task, packet):
+        """Records a setting update."""
+        self.settings[task] += 1
+
+    def read(self, service, calls=1):
+        """Records api calls made to read data."""
+        self.calls[service] += calls
+
+    def _expand_create_missing_task(self, tasks, labels, **packet):
+        self.put('create_story', {})
+        self.put('apply_tasks_to_issue', {})
+        self.put_setting('save_issue_data_task', {})
+        self.put('sync_tags', {
+            'tasks': list(tasks) + [None],
+            'labels': labels,
+            })
+
+    def _expand_apply_tasks_to_issue(self, **packet):
+        self.put('issue_edit', {})
+
+    def _expand_create_tag(self, labels, **packet):
+        self.new_tag_labels.update(labels)
+
+    def _expand_sync_tags(self, tasks, labels, present_tags=None, **packet):
+        label_tag_map = self.label_tag_map
+        tagged = [label for label in labels
+                  if label_tag_map.get(label) or label in self.new_tag_labels]
+
+        if tagged:
+            for task_id in tasks:
+                present = (present_tags or {}).get(str(task_id), ())
+                for label in tagged:
+                    if label_tag_map.get(label) not in present:
+                        self.put('add_tag', {})
+                self.put_setting('add_tags_to_task', {})
+
+    def estimate(self, service, concurrency, remaining=None, limit=None,
+                 reset_time=None):
+        """Estimates the seconds a service's planned calls would take.
+
+        Args:
+            service:
+                `str`. Service name.
+            concurrency:
+                `int`. Concurrent calls allowed to the service.
+            remaining:
+                `int`. Calls left in the current rate limit window, or
+                `None` if unknown.
+            limit:
+                `int`. Calls allowed per rate limit window.
+            reset_time:
+                `int`. Unix time at which the current window resets.
+
+        Returns:
+            `float`. Estimated seconds.
+        """
+        calls = self.calls[service]
+        seconds = calls * CALL_LATENCY[service] / max(concurrency, 1)
+
+        if service == 'asana':
+            # Calls are spread over minutes of the rate limit.
+            limited = 60.0 * (calls // ASANA_RATE_LIMIT)
+            return max(seconds, limited)
+
+        if remaining is None or calls <= remaining:
+            return seconds
+
+        # Wait for the current window to reset, then for every further
+        # window needed.
+        limited = max(reset_time - time.time(), 0) if reset_time else 0
+        windows = int(math.ceil(float(calls - remaining) / limit)) - 1
+        limited += GITHUB_RATE_WINDOW * max(windows, 0)
+        return max(seconds, limited)
@@ -0,0 +1,223 @@
+"""
+sync shards
+
+Splits the issues of a repository into ranges that several nodes claim
+through leases in a shared SQLite file, so a large sync can be spread over
+machines, each with its own credentials.
+
+"""
+
+import contextlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS shards (
+    repo INTEGER NOT NULL,
+    run TEXT NOT NULL,
+    low INTEGER NOT NULL,
+    high INTEGER NOT NULL,
+    owner TEXT,
+    lease_until REAL,
+    done REAL,
+    result TEXT,
+    PRIMARY KEY (repo, run, low)
+)
+"""
+
+class Shard(object):
+
+    """A range of issues claimed by a node."""
+
+    def __init__(self, repo, run, low, high):
+        self.repo = repo
+        self.run = run
+        self.low = low
+        self.high = high
+        self.lost = False
+
+class ShardStore(object):
+
+    """Shared store of shards and their leases.
+
+    A shard is leased to one node at a time. A node renews its lease while
+    it syncs the shard and flushes its work; a lease that runs out lets
+    another node claim the shard. Completed shards keep the data their node
+    synced, for every node to merge.
+    """
+
+    def __init__(self, filename, lease_ttl):
+        """
+        Args:
+            filename:
+                Filename of the SQLite store, shared by all nodes.
+            lease_ttl:
+                `int`. Seconds a lease lasts without renewal.
+        """
+        self.filename = filename
+        self.lease_ttl = lease_ttl
+        self.connection = self._connect()
+        self.connection.execute(SCHEMA)
+
+    def _connect(self):
+        """Returns a connection to the store, in autocommit mode."""
+        return sqlite3.connect(self.filename, timeout=60,
+                               isolation_level=None)
+
+    @property
+    def owner(self):
+        """Identifies the current node and process."""
+        return "%s:%d" % (socket.gethostname(), os.getpid())
+
+    def _transaction(self, statements):
+        """Runs `statements(cursor)` in an immediate transaction, so only
+        one node changes the store at a time."""
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            result = statements(cursor)
+        except:
+            cursor.execute("ROLLBACK")
+            raise
+
+        cursor.execute("COMMIT")
+        return result
+
+    def plan(self, repo, run, first_issue, last_issue, count):
+        """Splits issues `first_issue` to `last_issue` into `count` shards,
+        unless a node already did for this run."""
+
+        size = max((last_issue - first_issue + 1 + count - 1) // count, 1)
+
+        def statements(cursor):
+            cursor.execute("SELECT COUNT(*) FROM shards "
+                           "WHERE repo = ? AND run = ?", (repo, run))
+            if cursor.fetchone()[0]:
+                return
+
+            for low in range(first_issue, last_issue + 1, size):
+                cursor.execute("INSERT INTO shards (repo, run, low, high) "
+                               "VALUES (?, ?, ?, ?)",
+                               (repo, run, low,
+                                min(low + size - 1, last_issue)))
+
+        self._transaction(statements)
+
+    def claim(self, repo, run):
+        """Leases the next shard without a live lease.
+
+        Returns:
+            `Shard`, or `None` once every shard is done or leased.
+        """
+        now = time.time()
+
+        def statements(cursor):
+            cursor.execute("SELECT low, high FROM shards "
+                           "WHERE repo = ? AND run = ? AND done IS NULL "
+                           "AND (lease_until IS NULL OR lease_until < ?) "
+                           "ORDER BY low LIMIT 1", (repo, run, now))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+
+            cursor.execute("UPDATE shards SET owner = ?, lease_until = ? "
+                           "WHERE repo = ? AND run = ? AND low = ?",
+                           (self.owner, now + self.lease_ttl,
+                            repo, run, row[0]))
+            return Shard(repo, run, row[0], row[1])
+
+        return self._transaction(statements)
+
+    def renew(self, shard, connection=None):
+        """Extends the lease of a shard.
+
+        Args:
+            shard:
+                `Shard`. Shard leased by this node.
+            connection:
+                `sqlite3.Connection`. Connection of the calling thread,
+                when it isn't the store's.
+
+        Returns:
+            `True` while the lease is still held by this node.
+        """
+        cursor = (connection or self.connection).execute(
+            "UPDATE shards SET lease_until = ? "
+            "WHERE repo = ? AND run = ? AND low = ? AND owner = ? "
+            "AND done IS NULL",
+            (time.time() + self.lease_ttl, shard.repo, shard.run, shard.low,
+             self.owner))
+
+        return cursor.rowcount == 1
+
+    @contextlib.contextmanager
+    def leased(self, shard):
+        """Renews the lease of a shard every third of its ttl while the
+        block runs, from a thread, so it's kept however long a request or
+        flush takes. `shard.lost` is set once the lease is lost."""
+        stopped = threading.Event()
+
+        def keep_alive():
+            # sqlite connections can't be shared between threads.
+            connection = self._connect()
+            try:
+                while not stopped.wait(self.lease_ttl / 3.0):
+                    if not self.renew(shard, connection):
+                        shard.lost = True
+                        return
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=keep_alive,
+                                  name="lease-%d" % shard.low)
+        thread.daemon = True
+        thread.start()
+        try:
+            yield shard
+        finally:
+            stopped.set()
+            thread.join()
+
+    def release(self, shard):
+        """Gives up the lease of an unfinished shard."""
+        self.connection.execute(
+            "UPDATE shards SET owner = NULL, lease_until = NULL "
+            "WHERE repo = ? AND run = ? AND low = ? AND owner = ?",
+            (shard.repo, shard.run, shard.low, self.owner))
+
+    def complete(self, shard, result):
+        """Marks a shard done, with the data synced for it.
+
+        Returns:
+            `True` if the shard was still leased by this node, `False` if
+            another node claimed or completed it meanwhile.
+        """
+        cursor = self.connection.execute(
+            "UPDATE shards SET done = ?, result = ? "
+            "WHERE repo = ? AND run = ? AND low = ? AND owner = ? "
+            "AND done IS NULL",
+            (time.time(), json.dumps(result), shard.repo, shard.run,
+             shard.low, self.owner))
+
+        return cursor.rowcount == 1
+
+    def iter_results(self, repo, run):
+        """Yields the data of every completed shard of a run."""
+        cursor = self.connection.execute(
+            "SELECT result FROM shards "
+            "WHERE repo = ? AND run = ? AND done IS NOT NULL "
+            "ORDER BY low", (repo, run))
+
+        for row in cursor:
+            yield json.loads(row[0])
+
+    def pending(self, repo, run):
+        """Returns the number of shards of a run not yet done."""
+        cursor = self.connection.execute(
+            "SELECT COUNT(*) FROM shards "
+            "WHERE repo = ? AND run = ? AND done IS NULL", (repo, run))
+        return cursor.fetchone()[0]
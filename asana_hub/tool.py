@@ -3,43 +3,32 @@ Command-line interface for asana-hub.
 """
 
 import argparse
+import contextlib
+import functools
+import hashlib
 import logging
 import sys
 import os
+import threading
 import traceback
-import multiprocessing
-
-try:
-    from asana import Client
-    from asana import error as asana_errors
-    from github import Github
-
-    import urllib3
-    import certifi
-
-    # Setup pool manager and SSL verification.
-    http = urllib3.PoolManager(
-        cert_reqs='CERT_REQUIRED', # Force certificate check.
-        ca_certs=certifi.where(),  # Path to the Certifi bundle.
-    )
-
-    try:
-        import urllib3.contrib.pyopenssl
-        urllib3.contrib.pyopenssl.inject_into_urllib3()
-    except:
-        logging.debug("pyopenssl not detected.\n"
-            "to install pyopenssl: "
-            "pip install pyopenssl ndg-httpsclient pyasn1")
-
-except ImportError:
-    raise Exception("Could not import required packages.\n"
-        "Did you pip install -r requirements.txt ?")
 
 import transport
 
+from . import clients
+from . import fields
 from .json_data import JSONData
 from .action import Action
 
+def locked(method):
+    """Runs a method holding the app's data lock."""
+
+    @functools.wraps(method)
+    def wrapped(self, *args, **kwargs):
+        with self.data_lock:
+            return method(self, *args, **kwargs)
+
+    return wrapped
+
 class ToolApp(object):
 
     """Represents the AsanaHub app.
@@ -50,6 +39,9 @@ class ToolApp(object):
             `multiprocessing.Pool`. Pool for multithreaded processing.
     """
 
+    DEFAULT_CACHE_TTL = 86400
+    """Seconds identities, repositories and projects stay cached."""
+
     @classmethod
     def uniqify(cls, seq):
         """Returns a unique list of seq"""
@@ -70,16 +62,39 @@ class ToolApp(object):
         self.settings.apply('api-github', self.args.github_api,
             "enter github.com token")
 
+        # Api base urls, to run against stub servers.
+        self.settings.apply('asana-url', self.args.asana_url)
+        self.settings.apply('github-url', self.args.github_url)
+
+        clients.load()
+
         logging.debug("authenticating asana api.")
-        self.asana = Client.basic_auth(self.settings['api-asana'])
-        self.asana_errors = asana_errors
-        self.asana_me = self.asana.users.me()
+        self.asana = clients.asana_client(self.settings)
+        self.asana_errors = clients.asana_errors
         logging.debug("authenticating github api")
-        self.github = Github(self.settings['api-github'])
+        self.github = clients.github_client(self.settings)
+        # Lazy, github is only called when the user is first used.
         self.github_user = self.github.get_user()
 
+        self.cache_ttl = self.settings.apply('cache-ttl', self.args.cache_ttl,
+            on_save=int)
+        if self.cache_ttl is None:
+            self.cache_ttl = self.DEFAULT_CACHE_TTL
+
         self.oauth = True
 
+    def cached(self, key, load):
+        """Returns a value cached in settings, per `cache-ttl`."""
+        return self.settings.cached(key, load, self.cache_ttl,
+                                    refresh=self.args.refresh)
+
+    @property
+    def asana_me(self):
+        """Asana user of the api key, cached."""
+        key_hash = hashlib.sha1(self.settings['api-asana']).hexdigest()[:12]
+        return self.cached('asana-me:%s' % key_hash,
+            lambda: self.asana.users.me(**fields.asana('me')))
+
     @classmethod
     def _list_select(cls, lst, prompt, offset=0):
         """Given a list of values and names, accepts the index value or name."""
@@ -128,7 +143,7 @@ class ToolApp(object):
 
         # Select workspace
         as_projects = self.asana.projects.find_by_workspace(workspace['id'],
-            iterator_type=None)
+            iterator_type=None, **fields.asana('project_list'))
 
         projects = []
 
@@ -154,7 +169,9 @@ class ToolApp(object):
         """Returns key for issue_data in data."""
         return 'issue_data_%s' % namespace
 
-    def save_issue_data_task(self, issue, task_id, namespace='open'):
+    @locked
+    def save_issue_data_task(self, issue, task_id, namespace='open',
+                             parent=None):
         """Saves a issue data (tasks, etc.) to local data.
 
         Args:
@@ -164,6 +181,8 @@ class ToolApp(object):
                 `int`. Asana task ID.
             namespace:
                 `str`. Namespace for storing this issue.
+            parent:
+                `int`. Asana task ID of the task's parent, for subtasks.
         """
 
         issue_data = self.get_saved_issue_data(issue, namespace)
@@ -173,6 +192,9 @@ class ToolApp(object):
         elif task_id not in issue_data['tasks']:
             issue_data['tasks'].append(task_id)
 
+        if parent is not None:
+            self.get_saved_task_data(task_id)['parent'] = parent
+
     def has_saved_issue_data(self, issue, namespace='open'):
         issue_data_key = self._issue_data_key(namespace)
         issue_data = self.data.get(issue_data_key,
@@ -187,6 +209,7 @@ class ToolApp(object):
 
         return issue_data.has_key(str(issue_number))
 
+    @locked
     def get_saved_issue_data(self, issue, namespace='open'):
         """Returns issue data from local data.
 
@@ -212,6 +235,7 @@ class ToolApp(object):
         issue_data[str(issue_number)] = _data
         return _data
 
+    @locked
     def move_saved_issue_data(self, issue, ns, other_ns):
         """Moves an issue_data from one namespace to another."""
 
@@ -259,6 +283,7 @@ class ToolApp(object):
 
         return task_data.has_key(str(task_number))
 
+    @locked
     def get_saved_task_data(self, task):
         """Returns task data from local data.
 
@@ -285,36 +310,114 @@ class ToolApp(object):
     ### Misc. ###
     #############
 
+    def get_project(self, project_id):
+        """Retrieves a project from asana, cached."""
+
+        return self.cached('asana-project:%s' % project_id,
+            lambda: self.asana.projects.find_by_id(project_id,
+                                                   **fields.asana('project')))
+
+    def get_repo(self, repo_id):
+        """Retrieves a repository from github, cached."""
+
+        # The repository's urls are those of the server it came from.
+        key = 'github-repo:%s' % repo_id
+        if self.settings.get('github-url'):
+            key = 'github-repo:%s:%s' % (self.settings['github-url'], repo_id)
+
+        raw_data = self.cached(key,
+            lambda: self.github.get_repo(repo_id).raw_data)
+        return self.github.create_from_raw_data(clients.Repository, raw_data)
+
     def get_asana_task(self, asana_task_id):
         """Retrieves a task from asana."""
 
         try:
-            return self.asana.tasks.find_by_id(asana_task_id)
-        except asana_errors.NotFoundError:
+            return self.asana.tasks.find_by_id(asana_task_id,
+                                              **fields.asana('task'))
+        except clients.asana_errors.NotFoundError:
             return None
-        except asana_errors.ForbiddenError:
+        except clients.asana_errors.ForbiddenError:
             return None
 
+    @locked
+    def get_context_data(self, context):
+        """Returns the `JSONData` of the project a transport context
+        refers to, loading it if needed."""
+
+        if not context:
+            return self.data
+
+        filename = context['data-file']
+        if filename == self.data.filename:
+            return self.data
+
+        if filename not in self.context_data:
+            self.context_data[filename] = JSONData(filename=filename,
+                args=self.args, version=self.version)
+
+        return self.context_data[filename]
+
+    @property
+    def data(self):
+        """`JSONData` of the current project.
+
+        Within `data_context`, the context's data for the calling thread
+        only, so the settings consumer and the main thread may work on
+        different projects at once.
+        """
+        return getattr(self.local, 'data', None) or self.main_data
+
+    @data.setter
+    def data(self, data):
+        self.main_data = data
+
+    @contextlib.contextmanager
+    def data_context(self, data):
+        """Makes `data` the project data of the app within the block."""
+
+        previous_data = getattr(self.local, 'data', None)
+        self.local.data = data
+        try:
+            yield data
+        finally:
+            self.local.data = previous_data
+
     def sync_data(self):
 
-        # Updates transport data
-        transport.data.update(self.data.data)
+        # Publishes the project's run context to the transport
+        transport.publish_context(self.data.data)
 
     def flush(self):
+        """Waits for the transport, and for its settings to be applied."""
 
-        transport.flush(callback=self.flush_settings)
+        transport.flush()
 
     def flush_settings(self):
+        """Waits until settings put so far by workers are applied."""
 
-        for setting in transport.iter_settings():
-            task = setting.pop('task')
-            if task == "save_issue_data_task":
-                self.save_issue_data_task(**setting)
-            elif task == "add_tags_to_task":
-                self.add_tags_to_task(**setting)
-            else:
-                raise Exception("Unknown settings task: %s" % task)
+        transport.drain_settings()
+
+    def apply_setting(self, setting):
+        """Applies a setting put by a worker, in the consumer thread."""
 
+        with self.data_lock:
+            task = setting.pop('task')
+            data = self.get_context_data(setting.pop('context', None))
+
+            with self.data_context(data):
+                if task == "save_issue_data_task":
+                    self.save_issue_data_task(**setting)
+                elif task == "add_tags_to_task":
+                    self.add_tags_to_task(**setting)
+                elif task == "save_label_tags":
+                    self.save_label_tags(**setting)
+                elif task == "save_import_progress":
+                    self.save_import_progress(**setting)
+                else:
+                    raise Exception("Unknown settings task: %s" % task)
+
+    @locked
     def add_tags_to_task(self, task_id, tag_ids):
         task_data = self.get_saved_task_data(task_id)
         task_tag_ids = task_data.get('tags') or []
@@ -322,6 +425,60 @@ class ToolApp(object):
         logging.debug("\t\t - added %d tags to %s", len(tag_ids), task_id)
         task_data['tags'] = self.uniqify(task_tag_ids + tag_ids)
 
+    @locked
+    def save_label_tags(self, labels, tag_id, name=None, workspace_id=None):
+        """Maps github labels/milestones to an asana tag in local data.
+
+        Tags given with their `name` and `workspace_id` are also added to
+        the workspace's tag index.
+        """
+        label_tag_map = self.data.get('label-tag-map', {})
+
+        for label in labels:
+            label_tag_map[label] = tag_id
+
+        self.data['label-tag-map'] = label_tag_map
+
+        if name and workspace_id:
+            self.get_workspace_tag_index(workspace_id)['tags'][name] = tag_id
+
+    @locked
+    def get_workspace_tag_index(self, workspace_id):
+        """Returns the tag index of a workspace, shared by every project in
+        the settings.
+
+        The index holds the workspace's `tags`, by name, and the time they
+        were last `listed` from asana.
+        """
+        index = self.settings.get('workspace-tags', {})
+        workspace_index = index.setdefault(str(workspace_id), {})
+        workspace_index.setdefault('tags', {})
+        return workspace_index
+
+    @locked
+    def save_import_progress(self, source, index, task_id=None,
+                             issue_number=None):
+        """Records the progress of an imported record in local data.
+
+        Args:
+            source:
+                `str`. Path of the imported file.
+            index:
+                `int`. Index of the record in the file.
+            task_id:
+                `int`. Asana task created for the record.
+            issue_number:
+                `int`. Github issue created for the record.
+        """
+        import_progress = self.data.get('import-progress', {})
+        progress = import_progress.setdefault(source, {})
+        record = progress.setdefault(str(index), {})
+
+        if task_id:
+            record['task_id'] = task_id
+        if issue_number:
+            record['issue'] = issue_number
+
     def __init__(self, version):
         """Accepts version of the app."""
 
@@ -329,6 +486,10 @@ class ToolApp(object):
         self.version = version
         self.exit_code = 999
         self.oauth = False
+        self.context_data = {}
+        self.data_lock = threading.RLock()
+        self.local = threading.local()
+        self.main_data = None
 
         # Setup logging
         self.logger = logging.getLogger()
@@ -403,6 +564,13 @@ class ToolApp(object):
         # Add actions from the parent class. (The settings)
         Action.add_arguments(parser)
 
+        parser.add_argument(
+            '--refresh',
+            action='store_true',
+            dest='refresh',
+            help="reload cached users, repositories and projects.",
+            )
+
         parser.add_argument('-v', '--version', action='version',
             version='%(prog)s ' + '%s' % version)
 
@@ -437,20 +605,22 @@ class ToolApp(object):
             action = action_class(app=self, args=self.args)
 
             # Authenticate app
-            self.authenticate()
+            if action.requires_auth:
+                self.authenticate()
 
             # Begin transporters
-            transport.start(self)
+            self.sync_data()
+            transport.start(self, interactive_lane=action.interactive)
+
+            # Replay packets left over from an interrupted run
+            if action.requires_auth and not action.dry_run:
+                transport.replay()
 
             # Run action
             action.run()
 
-            # Flush transport, calling flush_settings every pass
-            transport.flush(callback=self.flush_settings)
-
-            # Flush settings queue
-            logging.debug("Flushing settings updates")
-            self.flush_settings()
+            # Flush transport and the settings of its packets
+            self.flush()
 
         except AssertionError as exc:
             logging.error("Error: %s", unicode(exc))
@@ -471,6 +641,11 @@ class ToolApp(object):
             self.settings.save()
             # Save data
             self.data.save()
+            for data in self.context_data.values():
+                data.save()
+
+            # Creation markers recorded in the saved data may now go.
+            transport.clear_settled_markers()
 
         self.exit_code = 0
 
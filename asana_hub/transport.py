@@ -6,87 +6,475 @@ Provides an interface for multiprocessing transport queues.
 
 """
 
+import copy
 import logging
 import re
 import multiprocessing
+import os
 import Queue
-import urllib3
-import certifi
-
-from asana import Client
-from asana import error as asana_errors
-from github import Github
+import random
+import threading
+import time
 
 import tool
 
-mem = multiprocessing.Manager()
+from . import clients
+from . import fields
+from . import mirror
+from . import packets
+from .journal import DeadLetters, Journal
+from .markers import CreationMarkers
+from .planner import Planner
+
+mem = None
+"""`multiprocessing.Manager`, started by `setup`."""
+
+shared_contexts = None
+"""Run contexts shared with workers, by context key."""
 
-data = mem.dict()
-"""Transient data about github and asana repo."""
+context_generation = None
+"""Count of run context updates, so workers know when to fetch them."""
 
-shutdown_event = mem.Event()
+shutdown_event = None
 """Shutdown event"""
 
-queue = mem.Queue()
-"""Multiprocessing transport queue."""
+LANES = ('interactive', 'critical', 'normal', 'background')
+"""Priority lanes of the transport, highest first.
+
+Lanes order the packets of one process's transport only; a sync running
+alongside an `issue` or `pr` has lanes and workers of its own.
+"""
 
-settings_queue = mem.Queue()
+PACKET_LANES = {
+    'create_missing_task': 'critical',
+    'apply_tasks_to_issue': 'critical',
+    'issue_edit': 'critical',
+    'create_tag': 'critical',
+    'add_subtask': 'critical',
+    'import_issue': 'critical',
+    'import_task': 'normal',
+    'update_task': 'normal',
+    'create_story': 'normal',
+    'sync_tags': 'background',
+    'add_tag': 'background',
+}
+"""Default lane of each packet type, `normal` if not listed."""
+
+SERVICES = ('asana', 'github', None)
+"""Services packets call. `None` is for packets that only queue others."""
+
+PACKET_SERVICES = {
+    'create_missing_task': 'asana',
+    'create_tag': 'asana',
+    'update_task': 'asana',
+    'create_story': 'asana',
+    'add_tag': 'asana',
+    'add_subtask': 'asana',
+    'import_task': 'asana',
+    'issue_edit': 'github',
+    'import_issue': 'github',
+}
+"""Service called by each packet type."""
+
+DEFAULT_WORKER_THREADS = 4
+"""Default number of packets each worker process runs at once, each on a
+thread with its own api clients."""
+
+DEFAULT_CONCURRENCY = {
+    'asana': 8,
+    'github': 4,
+}
+"""Default number of packets that may call a service at once."""
+
+STARVATION_INTERVAL = 8
+"""Every this many packets, a worker serves the lowest lanes first."""
+
+DEFAULT_RETRY_POLICIES = {
+    'rate_limit': {'tries': 6, 'base': 1.0, 'cap': 60.0},
+    'server': {'tries': 5, 'base': 0.5, 'cap': 30.0},
+    'connection': {'tries': 5, 'base': 0.5, 'cap': 30.0},
+}
+"""Retry policy of each class of retryable errors: the number of `tries`,
+and the `base` and `cap` in seconds of the exponential backoff."""
+
+BREAKER_THRESHOLD = 5
+"""Consecutive retryable failures of a service that open its breaker."""
+
+BREAKER_COOLDOWN = 30
+"""Seconds a service's packets are paused once its breaker opens."""
+
+queues = {}
+"""Multiprocessing transport queues, by lane and service."""
+
+ready = None
+"""Holds a token for every packet put on the transport queues."""
+
+service_slots = {}
+"""Semaphores capping the concurrent packets of each service."""
+
+journaled_keys = None
+"""Packet id by idempotency key, for packets in the journal not yet
+completed."""
+
+breakers = None
+"""Circuit breaker state of each service: consecutive `failures` and the
+time the breaker stays `open_until`."""
+
+interactive = False
+"""If set, packets put by the action are put on the interactive lane."""
+
+settings_queue = None
 """Multprocessing queue for updating settings."""
 
-processes = []
-"""Contains running workers."""
+settings_handler = None
+"""Applies a setting in the main process, set by `start`."""
+
+settings_consumer = None
+"""Thread of the main process applying settings as workers put them."""
+
+settings_drains = {}
+"""`threading.Event`s set once the consumer reaches a drain marker, by
+marker."""
+
+idle = None
+"""Set while no packets are queued or running."""
+
+pending = None
+"""Number of packets queued or running."""
+
+pending_lock = None
+"""Lock for updating `pending` and the worker statistics."""
+
+completed = None
+"""Number of packets completed that called a service."""
+
+busy_time = None
+"""Total seconds spent running packets that called a service."""
+
+live_workers = None
+"""Number of workers started and not yet exited."""
+
+spawner = None
+"""Process forking the workers, started by `setup`."""
+
+spawn_requests = None
+"""Pipe to the spawner, taking the arguments of each worker to start."""
+
+spawn_lock = threading.Lock()
+"""Serializes requests to the spawner."""
+
+IDLE_TIMEOUT = 5
+"""Seconds a worker waits for packets before it may exit."""
+
+SCALE_INTERVAL = 0.5
+"""Minimum seconds between two decisions to grow the pool."""
+
+TARGET_DRAIN = 2.0
+"""The pool grows while the queue would take longer than this many seconds
+to drain at the observed latency."""
+
+SCALE_GAIN = 1.05
+"""Growing must raise estimated throughput by this factor to continue."""
+
+SCALE_HOLD = 10
+"""Seconds the pool stops growing once growing did not help."""
+
+FLUSH_POLL_INTERVAL = 0.05
+"""Seconds between checks of a flush waiting for a number of packets."""
+
+DRAIN_SHARE = 0.2
+"""Share of a deadline's budget kept for draining packets already queued."""
+
+deadline = None
+"""Time after which queued packets are left for the next run, if set."""
+
+produce_deadline = None
+"""Time after which actions should stop queueing packets, if set."""
+
+worker_settings = None
+"""Settings the workers authenticate with, set by `start`."""
+
+worker_bounds = (0, multiprocessing.cpu_count())
+"""Minimum and maximum number of workers."""
+
+worker_threads = DEFAULT_WORKER_THREADS
+"""Packets each worker runs at once."""
+
+service_limits = dict(DEFAULT_CONCURRENCY)
+"""Maximum concurrent packets of each service."""
+
+retry_policies = dict(DEFAULT_RETRY_POLICIES)
+"""Retry policies in use, by error class."""
+
+main_pid = None
+"""Process id of the app, the only process that starts workers."""
+
+RUN_CONTEXT_KEYS = ('github-repo', 'asana-project', 'label-tag-map')
+"""Keys of the project data published to workers as a run context."""
+
+run_contexts = {}
+"""Run contexts known to this process, by context key. Each is a `dict`
+replaced, never changed, on update."""
+
+fetched_generation = {}
+"""`context_generation` at which a worker last fetched each context."""
+
+
+scale_state = {}
+"""Measurements at the previous scaling decision."""
+
+journal = None
+"""`Journal` recording the packets of this run."""
+
+journal_prefix = None
+"""Filename the journals of every run of the project start with."""
+
+dead_letters = None
+"""`DeadLetters` recording packets that could not be run."""
+
+markers = None
+"""`CreationMarkers` guarding task creation for issues."""
+
+context_markers = {}
+"""`CreationMarkers` of other contexts, by data file."""
+
+planner = None
+"""`Planner` recording packets instead of running them, if planning."""
+
+replayed = []
+"""Packets replayed from the journal by this run, as dicts with their
+`task`."""
+
 
 ASANA_SECTION_RE = re.compile(r'## Asana Tasks:\s+(.*#(\d{12,}))+', re.M)
 """Regular exprsssion to catch malformed data due to too many tasks."""
 
+def setup():
+    """Starts the multiprocessing manager and its shared objects, once.
+
+    Deferred until the transport is first used, so that commands which
+    never use it don't pay for the manager process.
+    """
+    global mem, shared_contexts, context_generation, shutdown_event, ready, \
+        settings_queue, pending, pending_lock, completed, busy_time, \
+        live_workers, breakers, idle, settings_consumer, journaled_keys
+
+    if mem is not None:
+        return
+
+    mem = multiprocessing.Manager()
+    shared_contexts = mem.dict(run_contexts)
+    context_generation = mem.Value('i', 0)
+    shutdown_event = mem.Event()
+    ready = mem.Queue()
+    settings_queue = mem.Queue()
+    pending = mem.Value('i', 0)
+    pending_lock = mem.Lock()
+    completed = mem.Value('i', 0)
+    busy_time = mem.Value('d', 0.0)
+    live_workers = mem.Value('i', 0)
+    breakers = mem.dict()
+    journaled_keys = mem.dict()
+    idle = mem.Event()
+    idle.set()
+
+    for lane in LANES:
+        for service in SERVICES:
+            queues[lane, service] = mem.Queue()
+
+    for service, limit in service_limits.iteritems():
+        service_slots[service] = mem.BoundedSemaphore(limit)
+
+    # Workers share the run's lock of the journal, so take it first.
+    if journal:
+        journal.hold()
+
+    # Fork the spawner before starting any thread.
+    _start_spawner()
+
+    if settings_handler:
+        settings_consumer = threading.Thread(target=_consume_settings,
+                                             name="settings-consumer")
+        settings_consumer.daemon = True
+        settings_consumer.start()
+
+def error_class(exc):
+    """Returns the retry policy name of an error, `None` if it must not be
+    retried."""
+
+    if isinstance(exc, clients.asana_errors.RateLimitEnforcedError):
+        return 'rate_limit'
+
+    if isinstance(exc, clients.asana_errors.RetryableAsanaError):
+        return 'server'
+
+    if isinstance(exc, clients.GithubException):
+        message = unicode(exc.data).lower()
+        if exc.status == 403 and ('abuse' in message or
+                                  'rate limit' in message):
+            return 'rate_limit'
+        if exc.status >= 500:
+            return 'server'
+        return None
+
+    if isinstance(exc, clients.connection_errors):
+        return 'connection'
+
+    return None
+
+def retry_delay(policy, tries, exc=None):
+    """Returns seconds to wait before a retry.
+
+    Uses exponential backoff with full jitter, so that retries of packets
+    failing together are spread out, but never less than the `retry_after`
+    an error asks for.
+    """
+    delay = random.uniform(0, min(policy['cap'],
+                                  policy['base'] * 2 ** tries))
+    return max(delay, getattr(exc, 'retry_after', None) or 0)
+
+def breaker_wait(service):
+    """Returns seconds until a service's breaker closes, 0 if closed."""
+    state = breakers.get(service)
+    if not state:
+        return 0
+
+    return max(state['open_until'] - time.time(), 0)
+
+def _record_failure(service):
+    """Counts a retryable failure of a service, opening its breaker once
+    failures reach `BREAKER_THRESHOLD`.
+
+    A breaker that closes after its cool down opens again on the next
+    failure, until a packet of the service succeeds.
+    """
+    with pending_lock:
+        state = breakers.get(service) or {'failures': 0, 'open_until': 0}
+        state['failures'] += 1
+        if state['failures'] >= BREAKER_THRESHOLD:
+            state['open_until'] = time.time() + BREAKER_COOLDOWN
+            logging.warn("%s is failing, pausing its packets for %ds",
+                         service, BREAKER_COOLDOWN)
+        breakers[service] = state
+
+def _record_success(service):
+    """Closes the breaker of a service."""
+    if breakers.get(service):
+        with pending_lock:
+            breakers[service] = None
+
+class Stopped(Exception):
+    """Raised by a packet abandoned because the transport is stopping."""
+
 def transport_task(func):
-    """Decorator for retrying tasks with special cases."""
+    """Decorator running a packet under the retry policy of its errors.
+
+    Retryable errors are retried with backoff, per `retry_policies`, and
+    count towards the breaker of the packet's service. Packets that run
+    out of tries, or fail unexpectedly, go to the dead-letter file.
+    """
+
+    service = PACKET_SERVICES.get(func.__name__)
 
     def wrapped_func(*args, **kwargs):
         tries = 0
         while True:
             try:
-                try:
-                    return func(*args, **kwargs)
+                result = func(*args, **kwargs)
 
-                except (asana_errors.InvalidRequestError,
-                        asana_errors.NotFoundError), exc:
-                    logging.warn("warning: invalid request: %r", exc)
+            except (clients.asana_errors.InvalidRequestError,
+                    clients.asana_errors.NotFoundError), exc:
+                logging.warn("warning: invalid request: %r", exc)
+                return None
 
-                except asana_errors.ForbiddenError, exc:
-                    logging.warn("forbidden error: %r", exc)
+            except clients.asana_errors.ForbiddenError, exc:
+                logging.warn("forbidden error: %r", exc)
+                return None
+
+            except Exception, exc:
+                policy_name = error_class(exc)
+                if policy_name is None:
+                    logging.exception("Exception in transport.")
+                    _dead_letter(func.__name__, kwargs, exc)
+                    return None
 
-                except asana_errors.NotFoundError, exc:
-                    logging.warn("not found error: %r", exc)
+                if service:
+                    _record_failure(service)
 
-                return None
-            except asana_errors.RetryableAsanaError, retry_exc:
                 tries += 1
-                logging.warn("retry exception %r on try %d", retry_exc, tries)
+                policy = retry_policies[policy_name]
+                if tries >= policy['tries']:
+                    logging.warn("giving up %s after %d tries: %r",
+                                 func.__name__, tries, exc)
+                    _dead_letter(func.__name__, kwargs, exc)
+                    return None
+
+                delay = retry_delay(policy, tries, exc)
+                if service:
+                    delay = max(delay, breaker_wait(service))
+
+                logging.warn("retry exception %r on try %d, retrying in %.1fs",
+                             exc, tries, delay)
+                if shutdown_event.wait(delay):
+                    # Left unfinished in the journal, for the next run.
+                    raise Stopped()
+                continue
 
-                if tries >= 3:
-                    raise
-            except Exception, exc:
-                logging.exception("Exception in transport.")
-                return
+            if service:
+                _record_success(service)
+
+            return result
 
     return wrapped_func
 
+def _dead_letter(task, packet, exc):
+    """Records a packet that could not be run."""
+    if dead_letters:
+        dead_letters.added(task, packet, repr(exc))
+
+    if task == 'create_missing_task':
+        # Let a later sync create the task, or find it in the mirror.
+        context = packet.get('context')
+        get_markers(context).release(context_value(context, 'github-repo'),
+                                     packet['issue_number'])
+
 
 class TransportWorker(object):
 
     """Represents a single thread worker that responds to a queue of tasks.
+
+    A worker process runs several, each on its own thread with its own api
+    clients, so its blocking requests overlap.
     """
 
     def __init__(self, settings):
         self.settings = settings
-        self.asana = Client.basic_auth(self.settings['api-asana'])
-        self.asana_me = self.asana.users.me()
-        self.github = Github(self.settings['api-github'])
-        self.github_user = self.github.get_user()
 
-    def run(self):
+        clients.load()
+        self.asana = clients.asana_client(self.settings)
+        self.github = clients.github_client(self.settings)
+
+        # Retries are left to the transport's retry policies.
+        self.asana.options['max_retries'] = 0
 
+        # Repositories loaded by this worker, by id.
+        self.repos = {}
+
+    def run(self, retiring, leader=True):
+        """Runs packets until shutdown.
+
+        Args:
+            retiring:
+                `threading.Event`. Set when the worker process retires.
+            leader:
+                `bool`. Retire the worker process when idle; other threads
+                of the process follow.
+
+        Returns:
+            `True` if the worker retired for lack of work.
+        """
+
+        picks = 0
         while True:
 
             if shutdown_event.is_set():
@@ -94,19 +482,57 @@ class TransportWorker(object):
                 break
 
             try:
-                packet = queue.get(timeout=5)
+                token = ready.get(timeout=IDLE_TIMEOUT)
             except Queue.Empty:
+                if retiring.is_set():
+                    return True
+                if leader and _retire():
+                    logging.debug("worker idle, retiring")
+                    retiring.set()
+                    return True
                 continue
 
-            # Handle packet
-            packet_task = packet.pop('task')
-            method = getattr(self, packet_task, None)
-            if not method:
-                raise Exception("Packet method '%s' is not supported." %
-                                packet_task)
+            if token is None:
+                logging.debug("got stop signal")
+                break
 
-            logging.debug("running packet: %s", packet_task)
-            method(**packet)
+            # Serve the lowest lanes first now and then, so they can't
+            # starve under a steady stream of higher priority packets.
+            picks += 1
+            lanes = LANES
+            if picks % STARVATION_INTERVAL == 0:
+                lanes = LANES[::-1]
+
+            packet, service = _next_packet(lanes)
+            if packet is None:
+                continue
+
+            started = time.time()
+            try:
+                self.handle(packet)
+            except Stopped:
+                logging.debug("packet left for the next run")
+            finally:
+                if service:
+                    service_slots[service].release()
+
+            _finish_packet(time.time() - started, service)
+
+    def handle(self, item):
+        """Runs an encoded packet."""
+
+        packet_id, packet = packets.decode(item)
+        method = getattr(self, packet.task)
+
+        logging.debug("running packet: %s", packet.task)
+        if journal and packet_id:
+            journal.started(packet_id)
+
+        method(**packet.arguments())
+
+        if journal and packet_id:
+            journal.completed(packet_id)
+            _forget_key(packet, packet_id)
 
     @transport_task
     def create_missing_task(self,
@@ -121,22 +547,45 @@ class TransportWorker(object):
                             issue_body,
                             tasks,
                             labels,
-                            label_tag_map):
+                            context=None):
 
-        """Creates a missing task."""
+        """Creates a missing task.
 
-        task = self.asana.tasks.create_in_workspace(
-            asana_workspace_id,
-            {
-                'name': name,
-                'notes': issue_body,
-                'assignee': assignee,
-                'projects': projects,
-                'completed': completed,
-            })
+        The task is only created if this thread can claim the creation
+        marker for the issue.
+        """
+
+        repo_id = context_value(context, 'github-repo')
+        creation_markers = get_markers(context)
+        if not creation_markers.claim(repo_id, issue_number):
+            logging.debug("task for issue #%d already created or in flight",
+                          issue_number)
+            return
 
-        # Announce task git issue
-        task_id = task['id']
+        try:
+            try:
+                task = self.asana.tasks.create_in_workspace(
+                    asana_workspace_id,
+                    {
+                        'name': name,
+                        'notes': mirror.issue_notes(issue_body, issue_number,
+                                                    issue_html_url),
+                        'assignee': assignee,
+                        'projects': projects,
+                        'completed': completed,
+                    }, **fields.asana('write'))
+            except (clients.asana_errors.InvalidRequestError,
+                    clients.asana_errors.ForbiddenError,
+                    clients.asana_errors.NotFoundError):
+                # The task was definitely not created, allow a later run to.
+                creation_markers.clear(repo_id, issue_number)
+                raise
+
+            # Announce task git issue
+            task_id = task['id']
+            creation_markers.created(repo_id, issue_number, task_id)
+        finally:
+            creation_markers.unclaim(repo_id, issue_number)
 
         put("create_story",
             task_id=task_id,
@@ -151,13 +600,15 @@ class TransportWorker(object):
             tasks=[task_id],
             issue_number=issue_number,
             issue_body=issue_body,
+            context=context,
             )
 
         # Save task to drive
         put_setting("save_issue_data_task",
                     issue=issue_number,
                     task_id=task_id,
-                    namespace=issue_state)
+                    namespace=issue_state,
+                    context=context)
 
         tasks.append(task_id)
 
@@ -165,11 +616,15 @@ class TransportWorker(object):
         put("sync_tags",
             tasks=tasks,
             labels=labels,
-            label_tag_map=label_tag_map)
+            context=context)
 
-    @transport_task
-    def get_repo(self):
-        return self.github.get_repo(data['github-repo'])
+    def get_repo(self, context=None):
+        """Returns the repository of a context, loaded once per worker."""
+        repo_id = context_value(context, 'github-repo')
+        if repo_id not in self.repos:
+            self.repos[repo_id] = self.github.get_repo(repo_id)
+
+        return self.repos[repo_id]
 
     @transport_task
     def add_tag(self, task_id, tag_id):
@@ -177,150 +632,895 @@ class TransportWorker(object):
         if not task_id or not tag_id:
             return
 
-        self.asana.tasks.add_tag(task=task_id, tag=tag_id)
+        self.asana.tasks.add_tag(task_id, {'tag': tag_id},
+                                 **fields.asana('write'))
 
     @transport_task
-    def sync_tags(self, tasks, labels, label_tag_map):
+    def sync_tags(self, tasks, labels, context=None, present_tags=None):
+        """Adds the tags of labels to tasks, per the label/tag map of the
+        run context.
+
+        Tags listed for a task in `present_tags` are already on it, and
+        are only recorded locally.
+        """
+
+        present_tags = present_tags or {}
 
         for task_id in tasks:
             tag_ids = []
+            present = present_tags.get(str(task_id), ())
 
-            added_tags = 0
             for label in labels:
-                tag_id = label_tag_map.get(label)
+                tag_id = label_tag(label, context)
                 if not tag_id:
                     continue
                 # if tag_id in tag_ids:
                 #     continue
                 tag_ids.append(tag_id)
+                if tag_id in present:
+                    continue
                 put("add_tag",
                     task_id=task_id,
                     tag_id=tag_id)
-                added_tags += 1
 
-            if added_tags:
+            if tag_ids:
                 put_setting("add_tags_to_task",
                             task_id=task_id,
-                            tag_ids=tag_ids)
+                            tag_ids=tag_ids,
+                            context=context)
 
     @transport_task
     def create_story(self, task_id, text):
         self.asana.stories.create_on_task(task_id,
-                                          { 'text': text })
+                                          { 'text': text },
+                                          **fields.asana('write'))
 
     @transport_task
-    def issue_edit(self, issue_number, body):
+    def issue_edit(self, issue_number, body, context=None):
 
-        repo = self.get_repo()
+        repo = self.get_repo(context)
         issue = repo.get_issue(issue_number)
         issue.edit(body=body)
 
     @transport_task
-    def apply_tasks_to_issue(self, tasks, issue_number, issue_body):
+    def apply_tasks_to_issue(self, tasks, issue_number, issue_body,
+                             context=None):
         """Applies task numbers to an issue."""
         issue_body = issue_body
-        task_numbers = format_task_numbers_with_links(tasks)
+        task_numbers = format_task_numbers_with_links(tasks, context)
         if task_numbers:
             new_body = ASANA_SECTION_RE.sub('', issue_body)
             new_body = new_body + "\n## Asana Tasks:\n\n%s" % task_numbers
             put("issue_edit",
                 issue_number=issue_number,
-                body=new_body)
+                body=new_body,
+                context=context)
             return new_body
 
         return issue_body
 
     @transport_task
     def update_task(self, task_id, params):
-        self.asana.tasks.update(task_id, params)
+        self.asana.tasks.update(task_id, params, **fields.asana('write'))
+
+    @transport_task
+    def create_tag(self, workspace_id, name, notes, labels, context=None):
+        """Creates a tag for github labels/milestones."""
+
+        tag = self.asana.tags.create(name=name,
+                                     workspace=workspace_id,
+                                     notes=notes,
+                                     **fields.asana('write'))
+
+        put_setting("save_label_tags",
+                    labels=labels,
+                    tag_id=tag['id'],
+                    name=name,
+                    workspace_id=workspace_id,
+                    context=context)
+
+    @transport_task
+    def add_subtask(self, task_id, name, notes, issue_number, issue_state):
+        """Creates a subtask, and saves it to the issue's tasks."""
+
+        task = self.asana.tasks.add_subtask(
+            task_id,
+            {
+            'name': name,
+            'notes': notes,
+            # TODO: Correct assignee.
+            'assignee': 'me',
+            }, **fields.asana('write'))
+
+        put_setting("save_issue_data_task",
+                    issue=issue_number,
+                    task_id=task['id'],
+                    namespace=issue_state,
+                    parent=task_id)
+
+    @transport_task
+    def import_task(self, source, index, title, body, asana_workspace_id,
+                    projects):
+        """Creates the task of an imported record, then queues its issue."""
+
+        task = self.asana.tasks.create_in_workspace(
+            asana_workspace_id,
+            {
+            'name': title,
+            'notes': body,
+            # TODO: Correct assignee.
+            'assignee': 'me',
+            'projects': projects,
+            }, **fields.asana('write'))
+
+        put_setting("save_import_progress",
+                    source=source,
+                    index=index,
+                    task_id=task['id'])
+
+        put("import_issue",
+            source=source,
+            index=index,
+            title=title,
+            body=body,
+            task_id=task['id'])
+
+    @transport_task
+    def import_issue(self, source, index, title, body, task_id,
+                     context=None):
+        """Creates the issue of an imported record, linked to its task."""
+
+        project_id = context_value(context, 'asana-project')
+        asana_task_url = tool.ToolApp.make_asana_url(project_id, task_id)
+
+        body = body + ("\n\n"
+            "**Asana: #%d**\n"
+            "%s" % (
+                task_id,
+                asana_task_url,
+            ))
+
+        issue = self.get_repo(context).create_issue(
+            title=title,
+            body=body.strip(),
+            )
+
+        put_setting("save_issue_data_task",
+                    issue=issue.number,
+                    task_id=task_id,
+                    context=context)
+
+        put_setting("save_import_progress",
+                    source=source,
+                    index=index,
+                    issue_number=issue.number,
+                    context=context)
 
-def run_worker(settings):
+        put("create_story",
+            task_id=task_id,
+            text="Git Issue #%d: \n"
+                  "%s" % (
+                    issue.number,
+                    issue.html_url,
+                    )
+            )
+
+def _run_thread(worker, retiring):
+    """Runs a worker on a thread of a worker process."""
     try:
-        worker = TransportWorker(settings)
-        worker.run()
+        worker.run(retiring, leader=False)
+    except:
+        logging.exception("Exception in transport thread.")
+        shutdown_event.set()
+
+def run_worker(settings, contexts, threads):
+    retired = False
+    try:
+        run_contexts.update(contexts)
+        retiring = threading.Event()
+
+        workers = [TransportWorker(settings) for _ in range(threads)]
+        others = [threading.Thread(target=_run_thread,
+                                   args=(worker, retiring))
+                  for worker in workers[1:]]
+        for thread in others:
+            thread.start()
+
+        try:
+            retired = workers[0].run(retiring)
+        finally:
+            for thread in others:
+                thread.join()
     except:
         shutdown_event.set()
         raise
+    finally:
+        if not retired:
+            with pending_lock:
+                live_workers.value -= 1
+
+def _retire():
+    """Returns `True` if an idle worker may exit, counting it out."""
+    with pending_lock:
+        if live_workers.value <= worker_bounds[0]:
+            return False
+
+        live_workers.value -= 1
+        return True
+
+def _start_spawner():
+    """Starts the process that forks workers.
+
+    Forking a process with threads running can leave a lock one of them
+    held, such as logging's, locked forever in the child. Workers are
+    forked by a process without threads instead, forked itself before
+    the main process starts any.
+    """
+    global spawner, spawn_requests
+
+    requests, spawn_requests = multiprocessing.Pipe(duplex=False)
+    spawner = multiprocessing.Process(target=_run_spawner,
+                                      args=(requests,),
+                                      name="worker-spawner")
+    spawner.start()
+    requests.close()
+
+def _run_spawner(requests):
+    """Forks a worker for each request, until a `None` request or the main
+    process exits, then waits for the workers."""
+
+    # Workers must not hold the main process's end of the pipe.
+    spawn_requests.close()
+
+    workers = []
+    while True:
+        try:
+            kwargs = requests.recv()
+        except (EOFError, KeyboardInterrupt):
+            kwargs = None
+
+        if kwargs is None:
+            break
+
+        process = multiprocessing.Process(target=run_worker, kwargs=kwargs)
+        process.start()
+        workers = [worker for worker in workers if worker.is_alive()]
+        workers.append(process)
+
+    for process in workers:
+        process.join()
+
+def _spawn_worker():
+    """Starts a worker process, through the spawner."""
+    with pending_lock:
+        live_workers.value += 1
+
+    with spawn_lock:
+        spawn_requests.send({
+            'settings': worker_settings,
+            'contexts': run_contexts,
+            'threads': worker_threads,
+        })
+
+def autoscale():
+    """Grows the worker pool to the demand on the transport.
+
+    Workers are started on demand, up to the maximum bound, while the queue
+    would take longer than `TARGET_DRAIN` seconds to drain at the observed
+    latency of service calls. Throughput is estimated as busy worker threads
+    over latency; once a growth fails to raise it, the pool holds for
+    `SCALE_HOLD` seconds. Idle workers retire by themselves down to the
+    minimum bound.
+    """
+    if os.getpid() != main_pid or worker_settings is None:
+        return
+
+    now = time.time()
+    last = scale_state
+    if last and now - last['time'] < SCALE_INTERVAL and live_workers.value:
+        return
+
+    alive = live_workers.value
+    capacity = alive * worker_threads
+    depth = pending.value
+    min_workers = worker_bounds[0]
+
+    if alive < min_workers or (depth and not alive):
+        for _ in range(max(min_workers - alive, 1)):
+            _spawn_worker()
+        return
+
+    done = completed.value
+    busy = busy_time.value
+    grow, baseline = 0, None
+
+    if last:
+        grow, baseline = _growth(last, now, alive, capacity, depth, done,
+                                 busy)
+
+    if grow:
+        logging.debug("growing worker pool to %d workers", alive + grow)
+        for _ in range(grow):
+            _spawn_worker()
+
+    scale_state.update({
+        'time': now,
+        'completed': done,
+        'busy': busy,
+        'baseline': baseline,
+        'warming': bool(grow),
+    })
+
+def _growth(last, now, alive, capacity, depth, done, busy):
+    """Judges the last growth of the pool, and decides on the next.
+
+    Returns:
+        `tuple`. Number of workers to start, and the throughput the pool
+        is judged against once they have started.
+    """
+    baseline = last.get('baseline')
+
+    done_in_window = done - last['completed']
+    latency = ((busy - last['busy']) / done_in_window
+               if done_in_window else None)
+    throughput = min(capacity, depth) / latency if latency else 0.0
+
+    if last['warming']:
+        # New workers get a window to start before they are judged.
+        pass
+
+    elif baseline is not None:
+        # A growth that did not raise throughput means we're limited
+        # elsewhere, by the services or their rate limits.
+        if throughput <= baseline * SCALE_GAIN:
+            last['hold_until'] = now + SCALE_HOLD
+            logging.debug("worker pool holding at %d workers", alive)
+        baseline = None
+
+    min_workers, max_workers = worker_bounds
+    drain = depth * latency / capacity if latency and capacity else 0
+    if (baseline is None and alive < max_workers and depth > capacity and
+        drain > TARGET_DRAIN and now >= last.get('hold_until', 0)):
+        return min(max_workers - alive, max(1, alive // 2)), throughput
+
+    return 0, baseline
+
+def _finish_packet(elapsed, service):
+    """Counts a packet as done, and its latency if it called a service."""
+    with pending_lock:
+        pending.value -= 1
+        if pending.value <= 0:
+            idle.set()
+        if service:
+            completed.value += 1
+            busy_time.value += elapsed
+
+def _add_pending(delta):
+    """Adjusts the count of pending packets."""
+    with pending_lock:
+        pending.value += delta
+        if pending.value == delta:
+            idle.clear()
+
+def _lane_key(task, priority=None):
+    """Returns the queue key of a packet type."""
+    if priority is None:
+        if interactive:
+            priority = 'interactive'
+        else:
+            priority = PACKET_LANES.get(task, 'normal')
+
+    assert priority in LANES, "unknown priority: %s" % priority
+    return priority, PACKET_SERVICES.get(task)
+
+def _queue_packet(packet, packet_id, priority=None):
+    """Puts a packet on its lane and announces it to the workers."""
+    _add_pending(1)
+    queues[_lane_key(packet.task, priority)].put(
+        packets.encode(packet, packet_id))
+    ready.put(True)
+
+def _take(lanes):
+    """Takes the next packet from the first lane whose service has a free
+    slot.
+
+    Returns:
+        Tuple of the packet and the service slot it holds, or `None`s.
+    """
+    for lane in lanes:
+        for service in SERVICES:
+            lane_queue = queues[lane, service]
+            if lane_queue.empty():
+                continue
+
+            if service and breaker_wait(service):
+                continue
+
+            slots = service_slots.get(service)
+            if slots and not slots.acquire(False):
+                continue
+
+            try:
+                return lane_queue.get_nowait(), service
+            except Queue.Empty:
+                if slots:
+                    slots.release()
+
+    return None, None
+
+def _next_packet(lanes):
+    """Takes the packet announced by a token taken from `ready`.
+
+    When all queued packets wait on busy services, waits for one of them,
+    handing the token back if its packet went to another worker.
+
+    Returns:
+        Tuple of the packet and the service slot it holds, or `None`s.
+    """
+    packet, service = _take(lanes)
+    if packet is None:
+        packet, service = _wait_for_service(lanes)
+        if packet is None:
+            ready.put(True)
+
+    return packet, service
+
+def _wait_for_service(lanes):
+    """Blocks until a service with queued packets has a free slot, then
+    takes its next packet, rather than polling `_take`. Waits for the
+    nearest breaker to close if every such service's breaker is open.
+
+    Returns:
+        Tuple of the packet and the service slot it holds, or `None`s if
+        another worker took the packet meanwhile.
+    """
+    waiting = set(service for lane in lanes for service in SERVICES
+                  if not queues[lane, service].empty())
+
+    open_services = [service for service in waiting
+                     if breaker_wait(service)]
+    if waiting and len(open_services) == len(waiting):
+        shutdown_event.wait(min(breaker_wait(service)
+                                for service in open_services))
+        return None, None
+
+    for service in SERVICES:
+        if service not in waiting or service in open_services:
+            continue
+
+        slots = service_slots.get(service)
+        if slots:
+            slots.acquire()
+
+        for lane in lanes:
+            try:
+                return queues[lane, service].get_nowait(), service
+            except Queue.Empty:
+                pass
+
+        if slots:
+            slots.release()
+        break
+
+    return None, None
 
 def put(task, **kwargs):
-    kwargs['task'] = task
-    queue.put(kwargs)
+    """Puts a packet on the transport.
+
+    A packet with the idempotency key of a packet still in the journal is
+    dropped, as that packet does the same work.
+
+    Args:
+        task:
+            `str`. Name of the `TransportWorker` method to run.
+        priority:
+            `str`. Lane to use instead of the packet type's default.
+        kwargs:
+            Arguments of the method.
+
+    Raises:
+        `packets.InvalidPacket` if the arguments don't match the packet
+        type.
+    """
+    priority = kwargs.pop('priority', None)
+    packet = packets.make(task, kwargs)
+
+    if planner:
+        planner.put(task, kwargs)
+        return
+
+    setup()
+
+    packet_id = Journal.new_id()
+    if journal:
+        if not _journal_key(packet, packet_id):
+            logging.debug("dropping %s packet, already in the journal", task)
+            return
+
+        journal.enqueued(packet_id, packet.as_dict())
+
+    _queue_packet(packet, packet_id, priority)
+    autoscale()
+
+def _journal_key(packet, packet_id):
+    """Records the idempotency key of a packet about to be journaled.
+
+    Returns:
+        `False` if a packet with the same key is still in the journal, in
+        which case the packet must be dropped.
+    """
+    key = packet.idempotency_key()
+    if key is None:
+        return True
+
+    return journaled_keys.setdefault(key, packet_id) == packet_id
+
+def _forget_key(packet, packet_id):
+    """Forgets the idempotency key of a completed packet."""
+    key = packet.idempotency_key()
+    if key is not None and journaled_keys.get(key) == packet_id:
+        journaled_keys.pop(key, None)
+
+def replay():
+    """Re-queues packets left unfinished by runs that are gone.
+
+    The journals of runs still alive, such as a sync running in the same
+    checkout, are left to them. Replayed packets move to this run's
+    journal. Packets the action puts again while their replayed packet is
+    still unfinished are dropped by `put`, by idempotency key.
+
+    Returns:
+        `int`. Number of packets replayed.
+    """
+    if not journal:
+        return 0
+
+    count = 0
+    for orphan in Journal.orphans(journal_prefix):
+        unfinished = orphan.pending()
+        if unfinished:
+            logging.info("replaying %d unfinished transport packets",
+                         len(unfinished))
+            setup()
+
+        for packet_id, values in unfinished.iteritems():
+            if _replay_packet(packet_id, values):
+                count += 1
+
+        orphan.discard()
+
+    if count:
+        autoscale()
+
+    return count
+
+def _replay_packet(packet_id, values):
+    """Re-queues a packet of another run's journal, journaling it to this
+    run's.
+
+    Returns:
+        `True` if the packet was queued.
+    """
+    task = values.pop('task')
+    try:
+        packet = packets.make(task, values)
+    except packets.InvalidPacket, exc:
+        logging.warn("dropping unfinished packet: %s", exc)
+        _dead_letter(task, values, exc)
+        return False
+
+    if not packet.replay:
+        logging.debug("dropping unfinished %s packet, left to sync", task)
+        return False
+
+    if not _journal_key(packet, packet_id):
+        logging.debug("dropping duplicate unfinished %s packet", task)
+        return False
+
+    journal.enqueued(packet_id, packet.as_dict())
+    replayed.append(packet.as_dict())
+
+    # Replayed packets aren't the action's own, whatever its lane.
+    _queue_packet(packet, packet_id, PACKET_LANES.get(packet.task, 'normal'))
+    return True
 
 def put_setting(task, **kwargs):
-    """Pushes a setting to the queue."""
+    """Pushes a setting to the queue.
+
+    A `context` keyword selects the project data the setting applies to.
+    """
+    if planner:
+        planner.put_setting(task, kwargs)
+        return
+
+    setup()
     kwargs['task'] = task
     settings_queue.put(kwargs)
 
-def flush(callback=None):
-    """Waits until queue is empty."""
+def flush(limit=0):
+    """Waits until all queued and running packets are done, and their
+    settings applied.
+
+    Args:
+        limit:
+            `int`. Return once no more than this many packets are left,
+            without waiting for settings.
+    """
+
+    if mem is None:
+        return
 
     while True:
         if shutdown_event.is_set():
             return
 
-        if callable(callback):
-            callback()
+        if pending.value <= limit:
+            break
 
-        try:
-            item = queue.get(timeout=1)
-            queue.put(item)  # put it back, we're just peeking.
-        except Queue.Empty:
+        if deadline and time.time() >= deadline:
+            logging.warn("deadline reached, leaving %d packets for the next "
+                         "run", pending.value)
+            stop()
             return
 
+        autoscale()
+
+        if limit:
+            shutdown_event.wait(FLUSH_POLL_INTERVAL)
+        else:
+            # Wakes up as soon as the last packet finishes.
+            idle.wait(SCALE_INTERVAL)
+
+    if not limit:
+        drain_settings()
+
+def _consume_settings():
+    """Applies settings from the workers until told to stop."""
+    while True:
+        setting = settings_queue.get()
+
+        if setting.get('task') is None:
+            if setting.get('stop'):
+                return
+            settings_drains.pop(setting['drain']).set()
+            continue
+
+        try:
+            settings_handler(setting)
+        except Exception:
+            logging.exception("failed to apply setting %r", setting)
+
+def drain_settings():
+    """Waits until every setting put so far has been applied."""
+    if settings_consumer is None or not settings_consumer.is_alive():
+        return
+
+    marker = Journal.new_id()
+    drained = settings_drains[marker] = threading.Event()
+    settings_queue.put({'task': None, 'drain': marker})
+    drained.wait()
+
 def issue_edit(issue, **kwargs):
     """Saves an issue"""
     put("issue_edit",
         issue_number=issue.number,
         **kwargs)
 
-def task_create(asana_workspace_id, name, notes, assignee, projects,
-                completed, **kwargs):
-    """Creates a task"""
-    put("task_create",
-        asana_workspace_id=asana_workspace_id,
-        name=name,
-        notes=notes,
-        assignee=assignee,
-        projects=projects,
-        completed=completed,
-        **kwargs)
+def _context_key(context):
+    """Returns the key of a context's run context."""
+    return context['data-file'] if context else None
 
-def start(app):
+def context_value(context, key):
+    """Returns a value of a transport context.
 
-    logging.debug("Starting multiprocess workers")
-    for _ in range(multiprocessing.cpu_count()):
-        process = multiprocessing.Process(target=run_worker,
-                                          kwargs={
-                                            'settings': app.settings.data,
-                                          })
-        process.start()
-        processes.append(process)
+    A context is a small dict naming the `github-repo`, `asana-project` and
+    `data-file` a packet belongs to. Other values, and those of packets
+    without a context, come from the run context.
+    """
+    if context and key in context:
+        return context[key]
+
+    values = run_contexts.get(_context_key(context))
+    if values is None and fetch_context(context):
+        values = run_contexts.get(_context_key(context))
+
+    return (values or {}).get(key)
+
+def fetch_context(context):
+    """Fetches a run context published since this process last did.
+
+    Workers get the run contexts when they start; this is the fallback for
+    those published or updated later.
+
+    Returns:
+        `True` if the run context was fetched.
+    """
+    if mem is None:
+        return False
+
+    context_key = _context_key(context)
+    generation = context_generation.value
+    if fetched_generation.get(context_key) == generation:
+        return False
+
+    fetched_generation[context_key] = generation
+    values = shared_contexts.get(context_key)
+    if values is None:
+        return False
+
+    run_contexts[context_key] = values
+    return True
+
+def label_tag(label, context=None):
+    """Returns the tag id of a label, per the run context."""
+    tag_id = (context_value(context, 'label-tag-map') or {}).get(label)
+    if tag_id is None and fetch_context(context):
+        tag_id = (context_value(context, 'label-tag-map') or {}).get(label)
+
+    return tag_id
+
+def get_markers(context=None):
+    """Returns the `CreationMarkers` for a context's data file."""
+    if not context:
+        return markers
+
+    filename = context['data-file']
+    if filename not in context_markers:
+        context_markers[filename] = CreationMarkers(filename + '.markers')
+
+    return context_markers[filename]
+
+def clear_settled_markers():
+    """Clears settled markers of every context."""
+    for context_marker in [markers] + context_markers.values():
+        if context_marker:
+            context_marker.clear_settled()
+
+def start_planning():
+    """Records packets put from now on in a `Planner`, instead of running
+    them.
+
+    Returns:
+        `Planner`. The plan.
+    """
+    global planner
+
+    planner = Planner()
+    return planner
+
+def publish_context(values, context=None):
+    """Publishes project data to workers as the run context of `context`.
+
+    Only `RUN_CONTEXT_KEYS` are kept. Workers started later receive the
+    run context when they start; running workers fetch it when they miss a
+    value.
+    """
+    context_key = _context_key(context)
+
+    frozen = dict(run_contexts.get(context_key) or {})
+    for key in RUN_CONTEXT_KEYS:
+        if key in values:
+            frozen[key] = copy.deepcopy(values[key])
+
+    run_contexts[context_key] = frozen
+
+    if planner and 'label-tag-map' in values:
+        planner.label_tag_map.update(values['label-tag-map'])
+
+    if mem is not None:
+        shared_contexts[context_key] = frozen
+        with pending_lock:
+            context_generation.value += 1
+
+def start(app, interactive_lane=False):
+    """Prepares the transport.
+
+    No worker is started until packets are put on the transport.
+
+    Args:
+        app:
+            `ToolApp`. App.
+        interactive_lane:
+            `bool`. Put packets on the interactive lane.
+    """
+    global journal, markers, interactive, worker_settings, worker_bounds, \
+        main_pid, dead_letters, settings_handler, worker_threads, \
+        journal_prefix
+
+    interactive = interactive_lane
+    main_pid = os.getpid()
+    settings_handler = app.apply_setting
+    worker_settings = app.settings.data
+
+    for service, limit in DEFAULT_CONCURRENCY.iteritems():
+        service_limits[service] = app.settings.apply(
+            '%s-concurrency' % service,
+            getattr(app.args, '%s_concurrency' % service, None),
+            on_save=int) or limit
+
+    min_workers = app.settings.apply('min-workers',
+        getattr(app.args, 'min_workers', None),
+        on_save=int) or 0
+    max_workers = app.settings.apply('max-workers',
+        getattr(app.args, 'max_workers', None),
+        on_save=int) or multiprocessing.cpu_count()
+    worker_bounds = (min_workers, max(min_workers, max_workers, 1))
+
+    worker_threads = app.settings.apply('worker-threads',
+        getattr(app.args, 'worker_threads', None),
+        on_save=int) or DEFAULT_WORKER_THREADS
+
+    policies = app.settings.apply('retry-policies',
+        getattr(app.args, 'retry_policies', None)) or {}
+    for name, policy in policies.iteritems():
+        retry_policies[name] = dict(DEFAULT_RETRY_POLICIES.get(name, {}),
+                                    **policy)
+
+    journal_prefix = app.data.filename + '.journal'
+    journal = Journal.for_run(journal_prefix)
+    dead_letters = DeadLetters(app.data.filename + '.dead-letter')
+    markers = CreationMarkers(app.data.filename + '.markers')
+
+def set_deadline(seconds):
+    """Sets a time budget for the transport, from now.
+
+    Actions should stop queueing packets once `deadline_near`, leaving
+    `DRAIN_SHARE` of the budget for queued packets to drain. Packets still
+    queued at the deadline are left in the journal, and replayed by the
+    next run.
+    """
+    global deadline, produce_deadline
+
+    now = time.time()
+    deadline = now + seconds
+    produce_deadline = now + seconds * (1 - DRAIN_SHARE)
+
+def deadline_near():
+    """Returns `True` if actions should stop queueing packets."""
+    return bool(produce_deadline) and time.time() >= produce_deadline
+
+def stop():
+    """Stops the workers once their running packets are done.
+
+    Workers waiting for packets are woken by a stop token each, rather than
+    waiting out their idle timeout.
+    """
+    if mem is None or shutdown_event.is_set():
+        return
+
+    shutdown_event.set()
+    for _ in range(live_workers.value * worker_threads):
+        ready.put(None)
 
 def shutdown():
     logging.debug("Shutting down transporter")
 
-    shutdown_event.set()
-    for p in processes:
-        p.join()
+    stop()
 
-def is_shutdown():
-    """Returns True if the app is requesting a global shutdown."""
-    return shutdown_event.is_set()
+    # The spawner exits once its workers have.
+    if spawner is not None:
+        with spawn_lock:
+            spawn_requests.send(None)
+        spawner.join()
 
-def iter_settings():
-    """Yields items from the settings queue."""
+    # Apply the last settings, then stop the consumer.
+    if settings_consumer is not None and settings_consumer.is_alive():
+        settings_queue.put({'task': None, 'stop': True})
+        settings_consumer.join()
 
-    while True:
-        try:
-            item = settings_queue.get(timeout=1)
-            yield item
-        except Queue.Empty:
-            return
+    # Keep only the packets that did not complete, for the next run.
+    if journal:
+        journal.compact()
+        journal.release()
+
+def is_shutdown():
+    """Returns True if the app is requesting a global shutdown."""
+    return mem is not None and shutdown_event.is_set()
 
-def format_task_numbers_with_links(tasks):
+def format_task_numbers_with_links(tasks, context=None):
     """Returns formatting for the tasks section of asana."""
 
-    project_id = data.get('asana-project', None)
+    project_id = context_value(context, 'asana-project')
 
     def _task_format(task_id):
         if project_id:
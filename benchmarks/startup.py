@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+startup benchmark
+
+Tracks the wall time of `asana-hub --help`, `connect` and `issue`.
+
+`issue` is run without a title, so it stops at the title prompt after
+authenticating and loading the repo and project, without creating anything.
+Unknown arguments, such as `-s` and `-d`, are passed on to asana-hub.
+
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+COMMANDS = [
+    ('help', ['--help']),
+    ('connect', ['connect']),
+    ('issue', ['issue', '--title']),
+]
+"""Benchmarked commands, by name."""
+
+def time_command(args, runs):
+    """Returns the wall times of `runs` runs of asana-hub with `args`."""
+
+    command = [sys.executable, os.path.join(ROOT, 'asana-hub')] + args
+    times = []
+
+    with open(os.devnull, 'r+b') as devnull:
+        for _ in range(runs):
+            start = time.time()
+            subprocess.call(command, stdin=devnull, stdout=devnull,
+                            stderr=devnull)
+            times.append(time.time() - start)
+
+    return times
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip())
+    parser.add_argument('-n', '--runs', type=int, default=5,
+                        help="runs per command (default: 5)")
+    parser.add_argument('-o', '--output',
+                        help="append results as a json line to this file")
+    parser.add_argument('-c', '--command', action='append',
+                        help="command to run, may be repeated (default: all)")
+    args, extra = parser.parse_known_args()
+
+    results = {}
+    for name, command_args in COMMANDS:
+        if args.command and name not in args.command:
+            continue
+
+        times = sorted(time_command(command_args + extra, args.runs))
+        results[name] = {
+            'min': times[0],
+            'median': times[len(times) // 2],
+            'max': times[-1],
+        }
+
+        print "%-8s min %.3fs  median %.3fs  max %.3fs" % (
+            name,
+            results[name]['min'],
+            results[name]['median'],
+            results[name]['max'],
+            )
+
+    if args.output:
+        with open(args.output, 'ab') as file:
+            file.write(json.dumps({
+                'time': time.time(),
+                'runs': args.runs,
+                'results': results,
+                }, sort_keys=True) + "\n")
+
+if __name__ == '__main__':
+    main()